@@ -4,19 +4,61 @@ Support for new CSV format and 3-step verification (PostOne -> Tracking -> Name)
 
 Requirements:
     pip install pypdf reportlab --break-system-packages
+
+Usage:
+    python add_ref_to_lab_v5.py labels.pdf mapping.csv output.pdf [--workers N] [--chunk-size N] [--cache [DIR]]
+                                [--report] [--fast-scan] [--roi X0,Y0,X1,Y1]
+                                [--split unmatched,warnings,clients] [--mmap]
+                                [--backend pypdf|pymupdf|pdftotext|auto] [--resume]
+    python add_ref_to_lab_v5.py labels_labeled.pdf mapping_fixed.csv labels_fixed.pdf --restamp [REPORT]
+                                (correction pass: only the unmatched/warning pages of an earlier --report run)
+    python add_ref_to_lab_v5.py --batch "inbox/*.pdf" --csv mapping.csv [--out-dir DIR] [--jobs N]
+    python add_ref_to_lab_v5.py --watch inbox/ --csv mapping.csv [--out-dir DIR] [--interval SEC]
+    python add_ref_to_lab_v5.py --serve 8765 --csv mapping.csv [--host ADDR] [--jobs N]
+    python add_ref_to_lab_v5.py --db shipments.db --ingest export1.csv export2.csv
+    python add_ref_to_lab_v5.py labels.pdf - output.pdf --db shipments.db   (match against all ingested exports)
+    python add_ref_to_lab_v5.py            (GUI file selection, needs tkinter)
+
+As a library (no Tk needed):
+    from add_ref_to_lab_v5 import LabelStamper
+    result = LabelStamper.from_csv("mapping.csv").stamp(pdf_bytes)   # result['pdf'], result['pages']
 """
 
 import sys
 import re
 import os
 import csv
+import io
+import gzip
+import json
+import time
+import hashlib
+import glob
+import codecs
+import shutil
+import tempfile
+import subprocess
+import mmap
+import base64
+import sqlite3
+import argparse
+import threading
+import itertools
+import contextlib
+import email.parser
+import email.policy
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 from pathlib import Path
 from datetime import datetime
-from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject,
+                           NameObject, NullObject, NumberObject, StreamObject)
 from io import BytesIO
-import tkinter as tk
-from tkinter import filedialog
+# tkinter and reportlab are imported where they are used: the GUI dialogs and the
+# overlay fallback are not needed when the module is used headless.
 
 def normalize_text(text):
     """Clean text for comparison (remove spaces, lowercase)"""
@@ -24,16 +66,382 @@ def normalize_text(text):
         return ""
     return re.sub(r'\s+', ' ', str(text)).strip().lower()
 
-def check_name_presence(name_parts, page_text):
+class NameIndex:
+    """
+    Aho-Corasick automaton over the normalized client names (ShipmentIndex.by_name).
+    find() scans the page text once and returns the same entry as a linear scan
+    over the by-name table: the first name (in CSV order) longer than 5 chars that
+    occurs in the text.
+    """
+    MIN_NAME_LENGTH = 6
+    
+    def __init__(self, by_name):
+        # Transitions live in one dict keyed by (state << 21) | ord(char),
+        # which is far smaller than one dict per trie node.
+        self._goto = {}
+        self._fail = [0]
+        self._best = [None]     # lowest name rank that ends in this state
+        self._entries = []      # rank -> {'ref':..., 'name':...}
+        children = [[]]
+        
+        for name_key, data in by_name.items():
+            if len(name_key) < self.MIN_NAME_LENGTH:
+                continue
+            state = 0
+            for ch in name_key:
+                key = (state << 21) | ord(ch)
+                nxt = self._goto.get(key)
+                if nxt is None:
+                    nxt = len(self._fail)
+                    self._goto[key] = nxt
+                    self._fail.append(0)
+                    self._best.append(None)
+                    children.append([])
+                    children[state].append((ch, nxt))
+                state = nxt
+            self._best[state] = len(self._entries)
+            self._entries.append(data)
+        
+        # Breadth-first pass: failure links, and fold the best rank reachable
+        # through the failure chain into each state so find() needs no output walk.
+        queue = deque(nxt for _, nxt in children[0])
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in children[state]:
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ((fail << 21) | ord(ch)) not in self._goto:
+                    fail = self._fail[fail]
+                fail = self._goto.get((fail << 21) | ord(ch), 0)
+                self._fail[nxt] = fail
+                inherited = self._best[fail]
+                if inherited is not None and (self._best[nxt] is None or inherited < self._best[nxt]):
+                    self._best[nxt] = inherited
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def find(self, page_text_norm):
+        """Return the data pack of the first CSV name found in the normalized text"""
+        goto = self._goto
+        fail = self._fail
+        best_by_state = self._best
+        state = 0
+        best = None
+        
+        for ch in page_text_norm:
+            code = ord(ch)
+            while state and ((state << 21) | code) not in goto:
+                state = fail[state]
+            state = goto.get((state << 21) | code, 0)
+            rank = best_by_state[state]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        
+        return self._entries[best] if best is not None else None
+
+class ShipmentIndex:
+    """
+    Lookup tables built from one shipment CSV.
+    Every table maps to the same {'ref':..., 'name':...} data pack per row.
+    """
+    
+    def __init__(self):
+        self.by_postone = {}    # Key: R-Number -> Value: {ref, name}
+        self.by_tracking = {}   # Key: Tracking -> Value: {ref, name}
+        self.by_name = {}       # Key: Full Name -> Value: {ref, name} (For fallback)
+        self.name_index = None
+        self.encoding = None
+        self.fallback_row = None    # first row decoded after falling back to another encoding
+        self.load_seconds = 0.0
+        self.source_key = None      # identifies the CSV it was loaded from (checkpoints)
+    
+    def __len__(self):
+        return len(self.by_postone)
+    
+    def add_row(self, p_number, tracking, ref_num, client_name):
+        data_pack = {'ref': ref_num, 'name': client_name}
+        
+        if p_number:
+            self.by_postone[p_number] = data_pack
+        if tracking:
+            self.by_tracking[tracking] = data_pack
+        if client_name:
+            self.by_name[normalize_text(client_name)] = data_pack
+    
+    def build_name_index(self):
+        """Build the name fallback automaton once all rows are in"""
+        self.name_index = NameIndex(self.by_name)
+    
+    def lookup_postone(self, p_num):
+        return self.by_postone.get(p_num) if p_num else None
+    
+    def lookup_tracking(self, tracking):
+        return self.by_tracking.get(tracking)
+    
+    def lookup_name(self, page_text_norm):
+        return self.name_index.find(page_text_norm)
+
+# Encodings seen in shipment exports, in order of preference
+CSV_ENCODINGS = ['utf-8-sig', 'utf-8', 'cp1251', 'latin-1']
+CSV_SAMPLE_BYTES = 64 * 1024
+
+def detect_csv_encoding(sample):
+    """Pick the first encoding from CSV_ENCODINGS that can decode the sample bytes"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    
+    for encoding in CSV_ENCODINGS[1:-1]:
+        try:
+            # final=False: the sample may end in the middle of a multi-byte character
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    
+    return CSV_ENCODINGS[-1]
+
+def _open_csv_source(mapping_csv):
+    if isinstance(mapping_csv, (bytes, bytearray)):
+        return io.BufferedReader(io.BytesIO(mapping_csv), buffer_size=CSV_SAMPLE_BYTES)
+    return open(mapping_csv, 'rb', buffering=CSV_SAMPLE_BYTES)
+
+def iter_shipment_rows(mapping_csv, detected=None):
+    """
+    Yield (postone, tracking, ref, name) for every data row of a shipment CSV.
+    mapping_csv: path or the CSV file content as bytes.
+    detected: optional dict that receives the 'encoding' used and, if the sample
+    guess had to be dropped, 'fallback_row' (first data row, 1-based, that the guess
+    could not decode).
+    The encoding is guessed from the first CSV_SAMPLE_BYTES and the rest is decoded
+    strictly: bytes the guess can't decode further down (e.g. an ASCII head followed
+    by cp1251 names) restart the file with the next encoding from CSV_ENCODINGS,
+    continuing after the rows already yielded.
+    """
+    source = _open_csv_source(mapping_csv)
+    # peek() fills the read buffer without consuming it, so the sample is not read twice
+    encoding = detect_csv_encoding(source.peek(CSV_SAMPLE_BYTES)[:CSV_SAMPLE_BYTES])
+    candidates = CSV_ENCODINGS[CSV_ENCODINGS.index(encoding):]
+    rows_read = 0
+    failed_encoding = None  # the encoding given up on, until the row it failed on is found
+    
+    for attempt, encoding in enumerate(candidates):
+        if detected is not None:
+            detected['encoding'] = encoding
+        if attempt:
+            source = _open_csv_source(mapping_csv)
+        
+        try:
+            with source as raw:
+                f = io.TextIOWrapper(raw, encoding=encoding, newline='')
+                reader = csv.reader(f)
+                next(reader, None) # Skip header
+                
+                for n, row in enumerate(reader):
+                    if n < rows_read: continue # Yielded before the restart
+                    rows_read += 1
+                    if failed_encoding:
+                        # Decoding failed somewhere in the buffered block: find the row itself
+                        try:
+                            "\x1f".join(row).encode(encoding).decode(failed_encoding)
+                        except UnicodeError:
+                            if detected is not None:
+                                detected.setdefault('fallback_row', n + 1)
+                            failed_encoding = None
+                    if len(row) < 7: continue # Ensure enough columns
+                    
+                    # Indices based on "Shipments-Гриин Деливери" file:
+                    # 0: Номер на пратка (R...)
+                    # 1: Проследяващ номер (Tracking)
+                    # 2: Номер по референция (Reference)
+                    # 6: Име на получател (Name)
+                    yield row[0].strip(), row[1].strip(), row[2].strip(), row[6].strip()
+            return
+        except UnicodeDecodeError:
+            if encoding == candidates[-1]:
+                raise
+            failed_encoding = encoding
+
+def csv_source_key(mapping_csv):
+    """[path, size, mtime] of a CSV file, or the SHA-256 of CSV bytes"""
+    if isinstance(mapping_csv, (bytes, bytearray)):
+        return hashlib.sha256(mapping_csv).hexdigest()
+    st = os.stat(mapping_csv)
+    return [os.path.abspath(mapping_csv), st.st_size, st.st_mtime]
+
+def load_shipment_index(mapping_csv):
+    """
+    Read the shipment CSV once: detect the encoding from the first
+    CSV_SAMPLE_BYTES and fill all lookup tables in one streaming pass.
+    mapping_csv: path or the CSV file content as bytes.
+    """
+    started = time.perf_counter()
+    index = ShipmentIndex()
+    detected = {}
+    
+    for p_number, tracking, ref_num, client_name in iter_shipment_rows(mapping_csv, detected):
+        index.add_row(p_number, tracking, ref_num, client_name)
+    
+    index.encoding = detected.get('encoding')
+    index.fallback_row = detected.get('fallback_row')
+    index.source_key = csv_source_key(mapping_csv)
+    index.build_name_index()
+    index.load_seconds = time.perf_counter() - started
+    return index
+
+class ShipmentDatabase:
+    """
+    Persistent shipment index in SQLite that accumulates many daily CSV exports,
+    so labels reprinted days later still find their shipment.
+    Same lookups as ShipmentIndex and the same "last row wins" rule for PostOne
+    and tracking numbers; ingesting a CSV twice is a no-op (keyed by content hash).
+    Name fallback: candidate names are found through their first
+    NameIndex.MIN_NAME_LENGTH characters, looked up among all substrings of that
+    length of the page, then confirmed as a substring of the page and ranked by
+    first ingestion. That is the same substring rule (and the CSV order) NameIndex
+    uses, so names glued to neighbouring text ('sig.giovanni') are found too.
+    Picklable: worker processes reopen the database by path.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS postone (number TEXT PRIMARY KEY, ref TEXT, name TEXT);
+        CREATE TABLE IF NOT EXISTS tracking (number TEXT PRIMARY KEY, ref TEXT, name TEXT);
+        CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                          name_norm TEXT UNIQUE, ref TEXT, name TEXT);
+        CREATE TABLE IF NOT EXISTS name_keys (token TEXT, name_id INTEGER,
+                                              PRIMARY KEY (token, name_id)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS imports (sha256 TEXT PRIMARY KEY, path TEXT, rows INTEGER,
+                                            encoding TEXT, imported_at TEXT);
+    """
+    # SQLite's default limit on bound parameters is 999 in older builds
+    MAX_QUERY_TOKENS = 500
+    # PRAGMA user_version; 1: name keys are name prefixes instead of whole words
+    SCHEMA_VERSION = 1
+    
+    def __init__(self, path):
+        self.path = path
+        self.encoding = None
+        self.load_seconds = 0.0
+        self._connect()
+    
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+            with self.conn:
+                # Databases from before version 1 have word keys: rebuild them from the names
+                self.conn.execute("DELETE FROM name_keys")
+                self.conn.execute("INSERT INTO name_keys SELECT substr(name_norm, 1, ?), id FROM names "
+                                  "WHERE length(name_norm) >= ?",
+                                  (NameIndex.MIN_NAME_LENGTH, NameIndex.MIN_NAME_LENGTH))
+                self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    def __getstate__(self):
+        return {'path': self.path, 'encoding': self.encoding, 'load_seconds': self.load_seconds}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect()
+    
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM postone").fetchone()[0]
+    
+    @property
+    def source_key(self):
+        """Database path and the CSVs ingested so far (a new ingest changes the lookups)"""
+        imports = self.conn.execute("SELECT COUNT(*) FROM imports").fetchone()[0]
+        return [os.path.abspath(self.path), imports]
+    
+    def name_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM names WHERE length(name_norm) >= ?",
+                                 (NameIndex.MIN_NAME_LENGTH,)).fetchone()[0]
+    
+    @staticmethod
+    def _name_key(name_norm):
+        return name_norm[:NameIndex.MIN_NAME_LENGTH]
+    
+    def ingest(self, mapping_csv):
+        """
+        Add one shipment CSV (path or bytes). Returns the number of rows read,
+        or None when this exact file was ingested before.
+        """
+        started = time.perf_counter()
+        sha256 = PageTextCache.file_hash(mapping_csv)
+        if self.conn.execute("SELECT 1 FROM imports WHERE sha256 = ?", (sha256,)).fetchone():
+            return None
+        
+        detected = {}
+        rows = 0
+        with self.conn:
+            cursor = self.conn.cursor()
+            for p_number, tracking, ref_num, client_name in iter_shipment_rows(mapping_csv, detected):
+                rows += 1
+                if p_number:
+                    cursor.execute("INSERT OR REPLACE INTO postone VALUES (?, ?, ?)",
+                                   (p_number, ref_num, client_name))
+                if tracking:
+                    cursor.execute("INSERT OR REPLACE INTO tracking VALUES (?, ?, ?)",
+                                   (tracking, ref_num, client_name))
+                if client_name:
+                    name_norm = normalize_text(client_name)
+                    # Keep the first position (ranking), take the latest data
+                    cursor.execute("INSERT INTO names (name_norm, ref, name) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(name_norm) DO UPDATE SET ref = excluded.ref, name = excluded.name",
+                                   (name_norm, ref_num, client_name))
+                    key = self._name_key(name_norm)
+                    if key and len(name_norm) >= NameIndex.MIN_NAME_LENGTH:
+                        cursor.execute("INSERT OR IGNORE INTO name_keys "
+                                       "SELECT ?, id FROM names WHERE name_norm = ?", (key, name_norm))
+            source = mapping_csv if isinstance(mapping_csv, (str, os.PathLike)) else None
+            cursor.execute("INSERT INTO imports VALUES (?, ?, ?, ?, ?)",
+                           (sha256, os.path.abspath(source) if source else None, rows,
+                            detected.get('encoding'), datetime.now().isoformat(timespec='seconds')))
+        
+        self.encoding = detected.get('encoding')
+        self.load_seconds = time.perf_counter() - started
+        return rows
+    
+    def _lookup(self, table, number):
+        row = self.conn.execute(f"SELECT ref, name FROM {table} WHERE number = ?", (number,)).fetchone()
+        return {'ref': row[0], 'name': row[1]} if row else None
+    
+    def lookup_postone(self, p_num):
+        return self._lookup('postone', p_num) if p_num else None
+    
+    def lookup_tracking(self, tracking):
+        return self._lookup('tracking', tracking)
+    
+    def lookup_name(self, page_text_norm):
+        size = NameIndex.MIN_NAME_LENGTH
+        tokens = list({page_text_norm[i:i + size] for i in range(len(page_text_norm) - size + 1)})
+        best = None
+        for start in range(0, len(tokens), self.MAX_QUERY_TOKENS):
+            batch = tokens[start:start + self.MAX_QUERY_TOKENS]
+            placeholders = ",".join("?" * len(batch))
+            candidates = self.conn.execute(
+                f"SELECT n.id, n.name_norm, n.ref, n.name FROM name_keys k JOIN names n ON n.id = k.name_id "
+                f"WHERE k.token IN ({placeholders}) ORDER BY n.id", batch)
+            for name_id, name_norm, ref, name in candidates:
+                if best is not None and name_id >= best[0]:
+                    break
+                if name_norm in page_text_norm:
+                    best = (name_id, {'ref': ref, 'name': name})
+                    break
+        return best[1] if best else None
+
+def check_name_presence(name_parts, page):
     """
     Check if parts of the name exist in the page text.
+    page: PageFeatures (or raw page text).
     Returns True if a significant part of the name is found.
     """
-    if not name_parts or not page_text:
+    if isinstance(page, str):
+        page = PageFeatures(page)
+    if not name_parts or not page.norm:
         return False
     
-    page_text_norm = normalize_text(page_text)
-    
     # Split full name into words (e.g., "Perna Cinzia Maria" -> ["perna", "cinzia", "maria"])
     # Filter out short words to avoid false positives on 'da', 'di', etc.
     parts = [p.lower() for p in name_parts.split() if len(p) > 2]
@@ -43,9 +451,12 @@ def check_name_presence(name_parts, page_text):
         
     # Check if ALL significant name parts are in the text (strict)
     # OR at least the last name and first name are present.
+    # Whole words are a set lookup; only parts glued to other text need the substring scan.
+    tokens = page.tokens
+    page_text_norm = page.norm
     matches = 0
     for part in parts:
-        if part in page_text_norm:
+        if part in tokens or part in page_text_norm:
             matches += 1
             
     # If more than 50% of the name parts are found, we consider it a match
@@ -55,6 +466,9 @@ def select_files_gui():
     """Open GUI dialogs to select PDF and CSV files"""
     print("\n🖱️  GUI MODE: Opening file selection dialogs...")
     
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     root.attributes('-topmost', True)
@@ -85,16 +499,29 @@ def select_files_gui():
     print(f"✓ Selected CSV: {Path(csv_path).name}")
     
     # Generate output filename
-    pdf_folder = Path(pdf_path).parent
-    pdf_name = Path(pdf_path).stem
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = pdf_folder / f"{pdf_name}_labeled_{timestamp}.pdf"
+    output_path = labeled_output_path(pdf_path)
     
     root.destroy()
-    return str(pdf_path), str(csv_path), str(output_path)
+    return str(pdf_path), str(csv_path), output_path
+
+def labeled_output_path(pdf_path, out_dir=None):
+    """
+    Output name next to the input (or in out_dir): <name>_labeled_<timestamp>.pdf
+    If a crashed run of this input left a checkpoint (<output>.partial/), its
+    output name is reused so the run can resume from it.
+    """
+    pdf_folder = Path(out_dir) if out_dir else Path(pdf_path).parent
+    pdf_name = Path(pdf_path).stem
+    partials = sorted(pdf_folder.glob(f"{glob.escape(pdf_name)}_labeled_*.pdf.partial"))
+    if partials:
+        return str(partials[-1])[:-len(".partial")]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return str(pdf_folder / f"{pdf_name}_labeled_{timestamp}.pdf")
 
 def create_reference_overlay(reference_number, page_width, page_height):
     """Create a PDF overlay with reference number at bottom-left"""
+    from reportlab.pdfgen import canvas
+    
     packet = BytesIO()
     can = canvas.Canvas(packet, pagesize=(page_width, page_height))
     
@@ -109,6 +536,100 @@ def create_reference_overlay(reference_number, page_width, page_height):
     packet.seek(0)
     return packet
 
+class ReferenceStamper:
+    """
+    Stamp "REF: ..." directly into a page's content stream.
+    Same text, font and position as create_reference_overlay, but without
+    building, writing and re-parsing an overlay PDF for every label.
+    The font dictionary and the "q" stream that opens every stamped page are
+    single indirect objects shared by all pages of the writer, so each stamp
+    only adds its own text-drawing operators and a reference to the font.
+    """
+    FONT_RESOURCE = "/FRefStamp"
+    FONT_SIZE = 10
+    # Position: bottom-left corner
+    X = 200
+    Y = 3
+    # Marked-content tag lets a later pass find the stamp again
+    PREFIX = f"/RefStamp BMC q BT {FONT_RESOURCE} {FONT_SIZE} Tf 1 0 0 1 {X} {Y} Tm (".encode('ascii')
+    SUFFIX = b") Tj ET Q EMC\n"
+    
+    def __init__(self, writer):
+        self.writer = writer
+        self._font = None       # shared indirect font dictionary
+        self._open = None       # shared indirect "q" stream
+    
+    def _shared_objects(self):
+        if self._font is None:
+            self._font = self.writer._add_object(DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica-Bold"),
+                NameObject("/Encoding"): NameObject("/WinAnsiEncoding")
+            }))
+            self._open = self._stream(b"q\n")
+        return self._font, self._open
+    
+    @staticmethod
+    def _pdf_string(text):
+        """Encode text as the body of a PDF literal string"""
+        data = text.encode('cp1252', errors='replace')
+        return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    
+    def _stream(self, data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self.writer._add_object(stream)
+    
+    def stamp(self, page, reference_number):
+        """Stamp a page that already belongs to self.writer (as returned by add_page)"""
+        font, open_stream = self._shared_objects()
+        
+        resources = page.get("/Resources")
+        if resources is None:
+            resources = DictionaryObject()
+            page[NameObject("/Resources")] = resources
+        resources = resources.get_object()
+        fonts = resources.get("/Font")
+        if fonts is None:
+            fonts = DictionaryObject()
+            resources[NameObject("/Font")] = fonts
+        fonts = fonts.get_object()
+        if self.FONT_RESOURCE not in fonts:
+            fonts[NameObject(self.FONT_RESOURCE)] = font
+        
+        contents = page.get("/Contents")
+        if contents is None:
+            original = []
+        else:
+            contents_obj = contents.get_object()
+            original = list(contents_obj) if isinstance(contents_obj, ArrayObject) else [contents]
+        
+        # Wrap the original content in q/Q so its graphics state can't move the stamp
+        text = self._pdf_string(f"REF: {reference_number}")
+        page[NameObject("/Contents")] = ArrayObject(
+            [open_stream] + original + [self._stream(b"Q\n" + self.PREFIX + text + self.SUFFIX)]
+        )
+    
+    @classmethod
+    def remove(cls, page):
+        """
+        Take a stamp added by stamp() off a page (e.g. a page of a previous output
+        opened with PdfReader); returns False if the page has no such stamp.
+        Stamps drawn by the overlay fallback are not tagged and stay.
+        """
+        contents = page.get("/Contents")
+        contents = contents.get_object() if contents is not None else None
+        if not isinstance(contents, ArrayObject) or len(contents) < 2:
+            return False
+        data = contents[-1].get_object().get_data()
+        if not (data.startswith(b"Q\n" + cls.PREFIX) and data.endswith(cls.SUFFIX)):
+            return False
+        if contents[0].get_object().get_data() != b"q\n":
+            return False
+        page[NameObject("/Contents")] = ArrayObject(contents[1:-1])
+        return True
+
 def extract_postone_number_from_page(text):
     """Extract PostOne number (R or P + 10 digits)"""
     try:
@@ -127,192 +648,2373 @@ def extract_tracking_from_page(text):
     except:
         return []
 
-def process_labels(input_pdf_path, mapping_csv_path, output_pdf_path):
-    print("\n" + "="*60)
-    print("📖 STEP 1: Reading mapping CSV (New Format)")
-    print("="*60)
+class PageFeatures:
+    """
+    Everything the matchers need from one page, computed once: the raw text,
+    its normalized form and word set (name search and verification) and the
+    PostOne/tracking IDs. Only text, IDs and scan flags are stored in the
+    cache or sent between processes; the normalized forms are rebuilt.
+    """
+    __slots__ = ('text', 'p_num', 'tracking', 'roi', 'partial', 'norm', 'tokens')
     
-    # Data storage
-    db_by_postone = {} # Key: R-Number -> Value: {ref, name}
-    db_by_tracking = {} # Key: Tracking -> Value: {ref, name}
-    db_by_name = {}     # Key: Full Name -> Value: {ref, name} (For fallback)
+    def __init__(self, text, p_num=None, tracking=None, roi=None, partial=False):
+        self.text = text or ""
+        self.p_num = p_num
+        self.tracking = tracking or []
+        self.roi = roi
+        self.partial = partial
+        self.norm = normalize_text(self.text)
+        self.tokens = frozenset(self.norm.split())
     
-    try:
-        # Try different encodings for CSV
-        encodings = ['utf-8-sig', 'utf-8', 'cp1251', 'latin-1']
-        rows_loaded = 0
+    def __reduce__(self):
+        return (PageFeatures, (self.text, self.p_num, self.tracking, self.roi, self.partial))
+    
+    def to_dict(self):
+        data = {'text': self.text, 'p_num': self.p_num, 'tracking': self.tracking}
+        if self.roi:
+            data['roi'] = self.roi
+        if self.partial:
+            data['partial'] = True
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('text'), data.get('p_num'), data.get('tracking'),
+                   data.get('roi'), data.get('partial', False))
+
+def extract_page_features(page_text, id_text=None, roi=None, partial=False):
+    """
+    Text and IDs of one page - the part of the work worth caching between runs.
+    id_text: text to take the IDs from instead of the full page (region of interest).
+    """
+    if id_text is None:
+        id_text = page_text
+    return PageFeatures(page_text,
+                        extract_postone_number_from_page(id_text),
+                        extract_tracking_from_page(id_text),
+                        roi, partial)
+
+# Literal "(...)" strings (one level of nested parentheses), hex "<...>" strings
+# and the brackets of TJ arrays in a raw content stream
+_CONTENT_TOKEN_RE = re.compile(
+    rb'\((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)|<([0-9A-Fa-f\s]*)>|(\[)|(\])', re.S)
+_LITERAL_ESCAPE_RE = re.compile(rb'\\([0-7]{1,3}|\r\n|.)', re.S)
+_LITERAL_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+                    b'\r\n': b'', b'\n': b'', b'\r': b''}
+
+def _unescape_literal(raw):
+    def replace(m):
+        code = m.group(1)
+        if code[:1].isdigit():
+            return bytes([int(code, 8) & 0xFF])
+        return _LITERAL_ESCAPES.get(code, code)
+    return _LITERAL_ESCAPE_RE.sub(replace, raw)
+
+def scan_content_strings(page):
+    """
+    Fast path: the strings drawn by the page's content stream, without running
+    the text-layout engine of extract_text(). Pieces of one TJ array are joined,
+    separate show operators go on separate lines. Works for the simple-font
+    labels we get; CID-font pages just yield nothing useful and fall back.
+    """
+    contents = page.get_contents()
+    if contents is None:
+        return ""
+    data = contents.get_data()
+    
+    lines = []
+    array_parts = None
+    for m in _CONTENT_TOKEN_RE.finditer(data):
+        if m.group(2):
+            array_parts = []
+            continue
+        if m.group(3):
+            if array_parts is not None:
+                lines.append("".join(array_parts))
+            array_parts = None
+            continue
+        if m.group(1) is not None:
+            hex_digits = re.sub(rb'\s', b'', m.group(1))
+            raw = bytes.fromhex((hex_digits + b'0' * (len(hex_digits) % 2)).decode('ascii'))
+        else:
+            raw = _unescape_literal(m.group(0)[1:-1])
+        text = raw.decode('latin-1')
+        if array_parts is not None:
+            array_parts.append(text)
+        else:
+            lines.append(text)
+    return "\n".join(lines)
+
+def extract_text_with_roi(page, roi):
+    """
+    Full page text plus only the text drawn inside roi = (x0, y0, x1, y1), in
+    PDF points from the bottom-left corner, collected by a text visitor.
+    """
+    x0, y0, x1, y1 = roi
+    parts = []
+    
+    def visitor(text, cm, tm, font_dict, font_size):
+        # Text origin in page space = text matrix translation through the CTM
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            parts.append(text)
+    
+    page_text = page.extract_text(visitor_text=visitor)
+    return page_text, "".join(parts)
+
+def extract_page_features_full(page, roi=None, backend=None, page_index=None):
+    """
+    Full text extraction features; IDs come from the region of interest when one is set.
+    backend: text backend instance (see TEXT_BACKENDS); pypdf's extract_text() by default.
+    page_index: position of the page in the input, needed by backends that open the file themselves.
+    """
+    if backend is None:
+        backend = PypdfTextBackend(None)
+    page_text, roi_text = backend.page_text(page_index, page, roi)
+    return extract_page_features(page_text, roi_text, roi=list(roi) if roi else None)
+
+def extract_page_features_fast(page):
+    """
+    IDs and text from the raw content strings only. Marked 'partial': the result
+    is used only when it gives a verified PostOne match, otherwise the page is
+    extracted in full. Content strings carry no position, so a region of
+    interest only applies to the full extraction.
+    """
+    return extract_page_features(scan_content_strings(page), partial=True)
+
+class PypdfTextBackend:
+    """
+    Default text extraction: pypdf's extract_text() on the page object.
+    Backends share this interface: available(), __init__(source),
+    page_text(page_index, page, roi) -> (page text, text inside roi or None) and
+    set_range(start, end): only pages [start, end) will be asked for next.
+    """
+    name = "pypdf"
+    
+    @staticmethod
+    def available(source=None):
+        return True
+    
+    def __init__(self, source):
+        self.source = source
+    
+    def set_range(self, start, end):
+        pass
+    
+    def page_text(self, page_index, page, roi=None):
+        if roi:
+            return extract_text_with_roi(page, roi)
+        return page.extract_text(), None
+
+class PyMuPdfTextBackend(PypdfTextBackend):
+    """PyMuPDF (pip install pymupdf), usually several times faster than pypdf"""
+    name = "pymupdf"
+    
+    @staticmethod
+    def _module():
+        try:
+            import pymupdf
+        except ImportError:
+            try:
+                import fitz as pymupdf
+            except ImportError:
+                return None
+        return pymupdf
+    
+    @classmethod
+    def available(cls, source=None):
+        return cls._module() is not None
+    
+    def __init__(self, source):
+        pymupdf = self._module()
+        self._rect = pymupdf.Rect
+        if isinstance(source, (bytes, bytearray)):
+            self.doc = pymupdf.open(stream=bytes(source), filetype="pdf")
+        else:
+            self.doc = pymupdf.open(source)
+    
+    def page_text(self, page_index, page, roi=None):
+        mu_page = self.doc[page_index]
+        text = mu_page.get_text()
+        if not roi:
+            return text, None
+        # PyMuPDF measures y from the top of the page
+        x0, y0, x1, y1 = roi
+        height = mu_page.rect.height
+        return text, mu_page.get_text(clip=self._rect(x0, height - y1, x1, height - y0))
+
+class PdftotextBackend(PypdfTextBackend):
+    """
+    poppler's pdftotext command line tool (needs a file path).
+    Pages are converted in blocks of up to BLOCK_PAGES per process start; a
+    block never runs past the end of the range given to set_range() (a worker's
+    shard), so no page is converted that another process handles.
+    """
+    name = "pdftotext"
+    BLOCK_PAGES = 50
+    
+    @staticmethod
+    def available(source=None):
+        return shutil.which("pdftotext") is not None and not isinstance(source, (bytes, bytearray))
+    
+    def __init__(self, source):
+        self.path = source
+        self._block_start = None
+        self._block = []
+        self._range_end = None
+    
+    def set_range(self, start, end):
+        self._range_end = end
+    
+    def _load_block(self, start):
+        end = start + self.BLOCK_PAGES
+        if self._range_end is not None and start < self._range_end:
+            end = min(end, self._range_end)
+        result = subprocess.run(
+            ["pdftotext", "-f", str(start + 1), "-l", str(end),
+             "-enc", "UTF-8", "-layout", str(self.path), "-"],
+            capture_output=True, check=True)
+        # Pages are separated by form feeds
+        self._block = result.stdout.decode('utf-8', errors='replace').split('\f')[:end - start]
+        self._block_start = start
+    
+    def page_text(self, page_index, page, roi=None):
+        if roi:
+            # No position information here: regions go through pypdf
+            return extract_text_with_roi(page, roi)
+        if (self._block_start is None or
+                not self._block_start <= page_index < self._block_start + len(self._block)):
+            self._load_block(page_index)
+        offset = page_index - self._block_start
+        return (self._block[offset] if offset < len(self._block) else ""), None
+
+TEXT_BACKENDS = {backend.name: backend for backend in
+                 (PypdfTextBackend, PyMuPdfTextBackend, PdftotextBackend)}
+
+def make_text_backend(name, source):
+    """Backend instance for one input (None/unknown/unavailable -> pypdf)"""
+    backend = TEXT_BACKENDS.get(name or "pypdf", PypdfTextBackend)
+    if not backend.available(source):
+        backend = PypdfTextBackend
+    return backend(source)
+
+def calibrate_text_backends(source, sample_pages=10, roi=None, log=print):
+    """
+    Time every available backend on the first sample_pages pages and return the
+    name of the fastest one that finds the same PostOne numbers and at least the
+    same tracking numbers as pypdf on every sampled page.
+    """
+    pages = list(itertools.islice(LazyPages(open_pdf(source)).iter_from(0), sample_pages))
+    results = {}
+    reference = None
+    
+    for name, backend_class in TEXT_BACKENDS.items():
+        if not backend_class.available(source):
+            continue
+        try:
+            backend = backend_class(source)
+            started = time.perf_counter()
+            features = []
+            for i, page in enumerate(pages):
+                text, roi_text = backend.page_text(i, page, roi)
+                features.append(extract_page_features(text, roi_text))
+            seconds = time.perf_counter() - started
+        except Exception as e:
+            log(f"   {name:<10} failed: {e}")
+            continue
         
-        for encoding in encodings:
+        if reference is None:
+            reference = features    # pypdf comes first and is the reference
+        same_ids = all(f.p_num == ref.p_num and set(ref.tracking) <= set(f.tracking)
+                       for f, ref in zip(features, reference))
+        results[name] = (seconds, same_ids)
+        per_page = seconds / len(pages) * 1000 if pages else 0.0
+        log(f"   {name:<10} {per_page:7.1f} ms/page  {'IDs ok' if same_ids else 'IDs differ - skipped'}")
+    
+    usable = [(seconds, name) for name, (seconds, same_ids) in results.items() if same_ids]
+    return min(usable)[1] if usable else "pypdf"
+
+def find_match(features, index):
+    """
+    Run the 3-step lookup (PostOne -> Tracking -> Name) and name verification for one page.
+    features: PageFeatures from extract_page_features().
+    Returns a plain dict so results can be sent back from worker processes.
+    """
+    result = {
+        'data': None,       # {'ref':..., 'name':...} of the matched order
+        'method': None,
+        'p_num': None,
+        'tracking': [],
+        'verified': False
+    }
+    
+    # --- 1. SEARCH BY POSTONE (R/P Number) ---
+    p_num = features.p_num
+    result['p_num'] = p_num
+    data = index.lookup_postone(p_num)
+    if data:
+        result['data'] = data
+        result['method'] = "PostOne ID"
+    
+    # --- 2. SEARCH BY TRACKING (Fallback) ---
+    if not result['data']:
+        track_nums = features.tracking
+        result['tracking'] = track_nums
+        for t in track_nums:
+            data = index.lookup_tracking(t)
+            if data:
+                result['data'] = data
+                result['method'] = "Tracking"
+                break
+    
+    # --- 3. SEARCH BY NAME (Deep Fallback) ---
+    # If ID/Tracking failed, try to find the client name in the text
+    if not result['data']:
+        data = index.lookup_name(features.norm)
+        if data:
+            result['data'] = data
+            result['method'] = "Client Name Search"
+    
+    # Perform Name Verification (Step 3 from requirements)
+    if result['data']:
+        result['verified'] = check_name_presence(result['data']['name'], features)
+    
+    return result
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "add_ref_to_lab")
+DEFAULT_CACHE_MAX_MB = 512
+
+class PageTextCache:
+    """
+    On-disk cache of extract_page_features() results, keyed by the PDF's
+    content hash, the text backend and page index (backends differ slightly in
+    the text they extract). One gzipped JSON file per PDF and backend; the least
+    recently used files are evicted once the folder exceeds max_bytes.
+    """
+    
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def file_hash(source):
+        """SHA-256 of the file content (renamed or copied PDFs still hit the cache); source: path or bytes"""
+        if isinstance(source, (bytes, bytearray)):
+            return hashlib.sha256(source).hexdigest()
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _path(self, pdf_hash, backend):
+        return os.path.join(self.cache_dir, f"{pdf_hash}.{backend}.json.gz")
+    
+    def load(self, pdf_hash, backend="pypdf"):
+        """Return {page index: features} for a PDF read with backend (empty dict on miss)"""
+        path = self._path(pdf_hash, backend)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                pages = json.load(f)
+            os.utime(path)  # mark as recently used for eviction
+        except (OSError, ValueError):
+            return {}
+        return {int(i): PageFeatures.from_dict(features) for i, features in pages.items()}
+    
+    def save(self, pdf_hash, pages, backend="pypdf"):
+        """Store {page index: features} for a PDF read with backend, then evict old entries if needed"""
+        path = self._path(pdf_hash, backend)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({str(i): features.to_dict() for i, features in pages.items()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+    
+    def evict(self, keep=None):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json.gz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
             try:
-                with open(mapping_csv_path, 'r', encoding=encoding, newline='') as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None) # Skip header
-                    
-                    if not header: continue
-                    
-                    # Reset dicts for new attempt
-                    db_by_postone = {}
-                    db_by_tracking = {}
-                    
-                    for row in reader:
-                        if len(row) < 7: continue # Ensure enough columns
-                        
-                        # Indices based on "Shipments-Гриин Деливери" file:
-                        # 0: Номер на пратка (R...)
-                        # 1: Проследяващ номер (Tracking)
-                        # 2: Номер по референция (Reference)
-                        # 6: Име на получател (Name)
-                        
-                        p_number = row[0].strip()
-                        tracking = row[1].strip()
-                        ref_num = row[2].strip()
-                        client_name = row[6].strip()
-                        
-                        data_pack = {'ref': ref_num, 'name': client_name}
-                        
-                        if p_number:
-                            db_by_postone[p_number] = data_pack
-                        if tracking:
-                            db_by_tracking[tracking] = data_pack
-                        if client_name:
-                            db_by_name[normalize_text(client_name)] = data_pack
-                            
-                    if len(db_by_postone) > 0:
-                        print(f"✓ Successfully read CSV with encoding: {encoding}")
-                        rows_loaded = len(db_by_postone)
-                        break
-            except UnicodeDecodeError:
+                st = os.stat(path)
+            except OSError:
                 continue
-            except Exception as e:
-                print(f"⚠️ Error with encoding {encoding}: {e}")
+            entries.append((st.st_mtime, st.st_size, path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
                 continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
 
-        if rows_loaded == 0:
-            print("❌ Could not read any valid data from CSV.")
-            return False
-            
-        print(f"✓ Loaded {rows_loaded} orders.")
+def analyze_page(page, features, index, scan=None, backend=None, page_index=None):
+    """
+    Extract (unless features are cached) and match one page.
+    scan: {'fast': bool, 'roi': (x0, y0, x1, y1) or None}. With 'fast', pages are
+    first matched from the raw content strings; full extraction only runs when
+    that doesn't give a verified PostOne match (name fallback or verification needs it).
+    Content strings carry no position, so with a 'roi' the fast path is off.
+    backend, page_index: text backend for full extraction, see extract_page_features_full().
+    Returns (match, newly extracted features or None, extract seconds, match seconds).
+    """
+    scan = scan or {}
+    roi = list(scan['roi']) if scan.get('roi') else None
+    extracted = None
+    extract_seconds = 0.0
+    match_seconds = 0.0
+    
+    fast = scan.get('fast') and not roi
+    
+    # Features cached for another region of interest don't apply, nor do fast-scan
+    # features outside a fast scan
+    if features is not None and (features.roi != roi or (features.partial and not fast)):
+        features = None
+    
+    if features is None:
+        started = time.perf_counter()
+        if fast:
+            features = extract_page_features_fast(page)
+        else:
+            features = extract_page_features_full(page, roi, backend, page_index)
+        extracted = features
+        extract_seconds += time.perf_counter() - started
+    
+    started = time.perf_counter()
+    match = find_match(features, index)
+    match_seconds += time.perf_counter() - started
+    
+    if features.partial and not (match['method'] == "PostOne ID" and match['verified']):
+        started = time.perf_counter()
+        features = extracted = extract_page_features_full(page, roi, backend, page_index)
+        extract_seconds += time.perf_counter() - started
         
-    except Exception as e:
-        print(f"❌ Critical error reading CSV: {e}")
-        return False
+        started = time.perf_counter()
+        match = find_match(features, index)
+        match_seconds += time.perf_counter() - started
+    
+    return match, extracted, extract_seconds, match_seconds
 
-    print("\n" + "="*60)
-    print("🔨 STEP 2: Processing PDF Labels")
-    print("="*60)
+class RunProfile:
+    """
+    Wall time and call counts per stage plus the per-page results of one run,
+    written as JSON and CSV next to the output PDF (--report).
+    Worker-side stages (extract_text, matching) are summed over all workers.
+    """
     
-    reader = PdfReader(input_pdf_path)
-    writer = PdfWriter()
-    total_pages = len(reader.pages)
-    
-    stats = {
-        'postone': 0,
-        'tracking': 0,
-        'name_search': 0,
-        'unmatched': 0,
-        'verified': 0,
-        'verification_failed': 0
-    }
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.stages = {}
+        self.pages = []
     
-    for i, page in enumerate(reader.pages):
-        page_num = i + 1
-        page_text = page.extract_text()
-        
-        print(f"\n📄 Page {page_num}/{total_pages}:")
-        
-        found_ref = None
-        found_data = None # Will hold {'ref':..., 'name':...}
-        method = None
-        
-        # --- 1. SEARCH BY POSTONE (R/P Number) ---
-        p_num = extract_postone_number_from_page(page_text)
-        if p_num and p_num in db_by_postone:
-            found_data = db_by_postone[p_num]
-            method = "PostOne ID"
-            stats['postone'] += 1
-        
-        # --- 2. SEARCH BY TRACKING (Fallback) ---
-        if not found_data:
-            track_nums = extract_tracking_from_page(page_text)
-            for t in track_nums:
-                if t in db_by_tracking:
-                    found_data = db_by_tracking[t]
-                    method = "Tracking"
-                    stats['tracking'] += 1
-                    break
+    def add(self, stage, seconds, calls=1):
+        entry = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+    
+    @contextlib.contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+    
+    def add_page(self, page_num, match, stamped):
+        data = match['data'] or {}
+        if not match['data']:
+            status = 'unmatched'
+        elif match['verified']:
+            status = 'verified'
+        else:
+            status = 'verification_failed'
+        self.pages.append({
+            'page': page_num,
+            'status': status,
+            'method': match['method'] or '',
+            'postone': match['p_num'] or '',
+            'ref': data.get('ref', ''),
+            'expected_name': data.get('name', ''),
+            'verified': bool(match['verified']),
+            'stamped': stamped
+        })
+    
+    def write(self, output_pdf_path, summary):
+        """Write <output>_report.json and <output>_report.csv; returns both paths"""
+        total_seconds = time.perf_counter() - self.started
+        json_path, csv_path = report_paths(output_pdf_path)
         
-        # --- 3. SEARCH BY NAME (Deep Fallback) ---
-        # If ID/Tracking failed, try to find the client name in the text
-        if not found_data:
-            page_text_norm = normalize_text(page_text)
-            for name_key, data in db_by_name.items():
-                # We check if the csv name exists in the page text
-                if name_key in page_text_norm and len(name_key) > 5:
-                    found_data = data
-                    method = "Client Name Search"
-                    stats['name_search'] += 1
-                    break
+        report = dict(summary)
+        report.update({
+            'started_at': self.started_at,
+            'total_seconds': round(total_seconds, 4),
+            'pages_per_second': round(len(self.pages) / total_seconds, 2) if total_seconds else None,
+            'stages': {name: {'seconds': round(entry['seconds'], 4), 'calls': entry['calls']}
+                       for name, entry in self.stages.items()},
+            'pages': self.pages
+        })
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
+        fields = ['page', 'status', 'method', 'postone', 'ref', 'expected_name', 'verified', 'stamped']
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.pages)
+        
+        return json_path, csv_path
 
-        # --- PROCESS RESULT & VERIFY ---
-        if found_data:
-            ref = found_data['ref']
-            expected_name = found_data['name']
-            
-            # Perform Name Verification (Step 3 from requirements)
-            is_verified = check_name_presence(expected_name, page_text)
-            
-            status_icon = "✅" if is_verified else "⚠️"
-            verify_msg = f"Name matched: '{expected_name}'" if is_verified else f"NAME MISMATCH? Exp: '{expected_name}'"
-            
-            if is_verified:
-                stats['verified'] += 1
-            else:
-                stats['verification_failed'] += 1
-            
-            print(f"   {status_icon} Found via {method}: {p_num if p_num else 'N/A'}")
-            print(f"   -> REF: {ref}")
-            print(f"   -> Verification: {verify_msg}")
-            
-            # Apply Stamp
-            try:
-                overlay = create_reference_overlay(ref, float(page.mediabox.width), float(page.mediabox.height))
-                page.merge_page(PdfReader(overlay).pages[0])
-            except Exception as e:
-                print(f"   ❌ Error stamping PDF: {e}")
-                
-        else:
-            print("   ❌ NO MATCH FOUND.")
-            print(f"      (Ids found: {p_num}, Tracking found: {extract_tracking_from_page(page_text)})")
-            stats['unmatched'] += 1
-            
-        writer.add_page(page)
+def report_paths(output_pdf_path):
+    """(<output>_report.json, <output>_report.csv) as written by RunProfile.write"""
+    base = os.path.splitext(output_pdf_path)[0]
+    return f"{base}_report.json", f"{base}_report.csv"
 
-    # Save Output
-    print("\n" + "="*60)
-    print("💾 STEP 3: Saving Output")
-    print("="*60)
+def load_run_report(path):
+    """
+    Per-page results of an earlier run from its JSON or CSV report, as the
+    dicts of RunProfile.pages (the CSV's text columns converted back).
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['pages']
     
-    with open(output_pdf_path, 'wb') as f:
-        writer.write(f)
-        
-    # Final Report
-    print(f"\n📊 SUMMARY REPORT:")
-    print(f"   Total Pages: {total_pages}")
-    print(f"   Matched by PostOne (R/P): {stats['postone']}")
-    print(f"   Matched by Tracking:      {stats['tracking']}")
-    print(f"   Matched by Name Search:   {stats['name_search']}")
-    print(f"   -------------------------")
-    print(f"   ✅ Name Verification Passed: {stats['verified']}")
-    print(f"   ⚠️ Name Verification Warning: {stats['verification_failed']}")
-    print(f"   ❌ Unmatched Pages:          {stats['unmatched']}")
-    print(f"\n   File saved to: {output_pdf_path}")
+    pages = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            row['page'] = int(row['page'])
+            row['verified'] = row['verified'] == 'True'
+            row['stamped'] = row['stamped'] == 'True'
+            pages.append(row)
+    return pages
+
+def open_pdf(source, lazy=False):
+    """
+    PdfReader over a path or the PDF content as bytes.
+    lazy: memory-map the file instead of reading it through a buffered file; several
+    processes mapping the same file share one copy in the OS page cache.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return PdfReader(io.BytesIO(source))
+    if lazy:
+        with open(source, 'rb') as f:
+            # The mapping stays valid after the file is closed
+            return PdfReader(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return PdfReader(source)
+
+def count_pages(source, lazy=False):
+    """Number of pages in the PDF, read from the page tree root without loading every page"""
+    reader = open_pdf(source, lazy)
+    try:
+        return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+    except (KeyError, TypeError, ValueError):
+        return len(reader.pages)
+
+def release_parsed_objects(reader):
+    """
+    Drop the reader's cache of parsed objects (content streams, fonts, ...).
+    Page dictionaries are separate copies, and anything needed again is
+    re-read from the file on demand.
+    """
+    reader.resolved_objects.clear()
+
+class LazyPages:
+    """
+    Pages of a reader without flattening the page tree: reader.pages builds a
+    PageObject for every page on first use, this walks /Kids on demand and only
+    keeps the path from the root to the current page. Inheritable attributes are
+    copied down as pypdf does.
+    """
+    INHERITABLE = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
     
-    return True
+    def __init__(self, reader):
+        self.reader = reader
+        self.root = reader.trailer["/Root"]["/Pages"]
+    
+    def _inherit(self, inherited, node):
+        inherited = dict(inherited)
+        for attr in self.INHERITABLE:
+            if attr in node:
+                inherited[attr] = node[attr]
+        return inherited
+    
+    def _page(self, ref, node, inherited):
+        page = PageObject(self.reader, ref if isinstance(ref, IndirectObject) else None)
+        page.update(node)
+        for attr, value in inherited.items():
+            if attr not in page:
+                page[NameObject(attr)] = value
+        return page
+    
+    def iter_from(self, start=0):
+        """Yield pages from index start on; whole subtrees before start are skipped by /Count"""
+        root = self.root.get_object()
+        kids = root.get("/Kids", ArrayObject()).get_object()
+        inherited = self._inherit({}, root)
+        stack = []      # (kids, next position, inherited) of the enclosing /Pages nodes
+        pos = 0
+        skip = start
+        # Usual flat tree (every kid is a page): jump straight to the start page
+        if skip and int(root.get("/Count", -1)) == len(kids):
+            pos, skip = skip, 0
+        
+        while True:
+            if pos >= len(kids):
+                if not stack:
+                    return
+                kids, pos, inherited = stack.pop()
+                continue
+            ref = kids[pos]
+            pos += 1
+            node = ref.get_object()
+            if "/Kids" in node:
+                count = int(node.get("/Count", 0))
+                if skip >= count:
+                    skip -= count
+                    continue
+                stack.append((kids, pos, inherited))
+                kids = node["/Kids"].get_object()
+                inherited = self._inherit(inherited, node)
+                pos = 0
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield self._page(ref, node, inherited)
 
-if __name__ == "__main__":
-    if len(sys.argv) == 4:
-        process_labels(sys.argv[1], sys.argv[2], sys.argv[3])
-    else:
-        result = select_files_gui()
-        if result:
-            process_labels(*result)
+def reader_pages(reader, lazy=False):
+    """Iterator over all pages: lazily walked page tree or pypdf's page list"""
+    return LazyPages(reader).iter_from(0) if lazy else iter(reader.pages)
+
+def iter_input_pages(source, total_pages, chunk_size=None, lazy=False):
+    """
+    Yield the input pages in order (source: path or bytes).
+    With chunk_size the reader's parsed objects are released every chunk_size
+    pages, so memory doesn't grow with the number of pages.
+    lazy: memory-mapped input and lazily resolved pages (see LazyPages); pages
+    already handed out are not kept, and parsed objects are released every
+    LAZY_RELEASE_PAGES pages even without chunk_size.
+    """
+    reader = open_pdf(source, lazy)
+    release_every = chunk_size or (LAZY_RELEASE_PAGES if lazy else None)
+    for i, page in enumerate(reader_pages(reader, lazy)):
+        if i >= total_pages:
+            break
+        if release_every and i and i % release_every == 0:
+            release_parsed_objects(reader)
+        yield page
+
+LAZY_RELEASE_PAGES = 200
+
+# Per-process state for parallel mode (set once by the pool initializer)
+_worker_state = {}
+
+def _init_worker(source, index, chunk_size=None, scan=None, lazy=False):
+    """Open the PDF and keep the shipment index in each worker process"""
+    _worker_state['reader'] = open_pdf(source, lazy)
+    _worker_state['index'] = index
+    _worker_state['chunk_size'] = chunk_size
+    _worker_state['scan'] = scan
+    _worker_state['lazy'] = lazy
+    _worker_state['backend'] = make_text_backend((scan or {}).get('backend'), source)
+    _worker_state['pages_read'] = 0
+
+def _match_page_range(shard):
+    """
+    Extract text and match pages [start, end) inside a worker process.
+    cached maps page index -> features for pages that need no extraction.
+    Returns analyze_page() results per page.
+    """
+    start, end, cached = shard
+    reader = _worker_state['reader']
+    index = _worker_state['index']
+    
+    # In streaming/lazy mode workers release parsed objects too, so their memory stays bounded
+    lazy = _worker_state['lazy']
+    release_every = _worker_state['chunk_size'] or (LAZY_RELEASE_PAGES if lazy else None)
+    if release_every and _worker_state['pages_read'] >= release_every:
+        release_parsed_objects(reader)
+        _worker_state['pages_read'] = 0
+    _worker_state['pages_read'] += end - start
+    
+    scan = _worker_state['scan']
+    if lazy:
+        pages = LazyPages(reader).iter_from(start)
+    else:
+        pages = (reader.pages[i] for i in range(start, end))
+    backend = _worker_state['backend']
+    backend.set_range(start, end)
+    return [analyze_page(page, cached.get(i), index, scan, backend, i)
+            for i, page in zip(range(start, end), pages)]
+
+def _record_page_analysis(i, result, cached_pages, profile):
+    """
+    Keep newly extracted features for the cache (if any) and add the timings to the profile.
+    Fast-scan (partial) features are not cached: they are cheap to redo and only valid for fast scans.
+    """
+    match, extracted, extract_seconds, match_seconds = result
+    if extracted is not None:
+        if cached_pages is not None and not extracted.partial:
+            cached_pages[i] = extracted
+        if profile:
+            profile.add('extract_text', extract_seconds)
+    if profile:
+        profile.add('matching', match_seconds)
+
+def iter_page_matches(source, total_pages, index, workers=None, chunk_size=None,
+                      cached_pages=None, profile=None, scan=None, lazy=False, known_matches=None):
+    """
+    Yield (page, match) for every page of source (path or bytes) in original page order.
+    With workers > 1 the page range is sharded across a process pool.
+    cached_pages: {page index: features} from PageTextCache; pages found there are
+    not extracted again, and newly extracted pages are added to it. Without it
+    (no --cache) extracted features are dropped as soon as the page is matched.
+    profile: RunProfile that receives extract_text/matching timings.
+    scan: identifier scan options, see analyze_page().
+    lazy: memory-mapped input with lazily resolved pages, in this process and the workers.
+    known_matches: {page index: match} decided in an earlier run (checkpoint journal);
+    those pages are yielded without extraction or matching.
+    """
+    pages = iter_input_pages(source, total_pages, chunk_size, lazy)
+    cached = cached_pages if cached_pages is not None else {}
+    known_matches = known_matches or {}
+    # Journal entries form a prefix of the page range; only the rest needs analysis
+    first_new = 0
+    while first_new in known_matches:
+        first_new += 1
+    
+    # Nothing to extract (e.g. a rerun with a fixed CSV): matching alone doesn't need the pool
+    all_cached = all(i in cached and not cached[i].partial
+                     for i in range(first_new, total_pages))
+    
+    if not workers or workers <= 1 or total_pages - first_new < 2 or all_cached:
+        backend = make_text_backend((scan or {}).get('backend'), source)
+        for i, page in enumerate(pages):
+            if i < first_new:
+                yield page, known_matches[i]
+                continue
+            result = analyze_page(page, cached.get(i), index, scan, backend, i)
+            _record_page_analysis(i, result, cached_pages, profile)
+            yield page, result[0]
+        return
+    
+    # Several small shards per worker keep the pool balanced when some pages are slow
+    shard_size = max(1, min(50, -(-total_pages // (workers * 4))))
+    shards = []
+    for start in range(first_new, total_pages, shard_size):
+        end = min(start + shard_size, total_pages)
+        shards.append((start, end, {i: cached[i] for i in range(start, end) if i in cached}))
+    
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(source, index, chunk_size, scan, lazy)) as pool:
+        # map() returns shards in submission order, so page order is preserved
+        results = (result for shard_results in pool.map(_match_page_range, shards)
+                   for result in shard_results)
+        for i, page in enumerate(pages):
+            if i < first_new:
+                yield page, known_matches[i]
+                continue
+            result = next(results)
+            _record_page_analysis(i, result, cached_pages, profile)
+            yield page, result[0]
+
+class PdfOutput:
+    """
+    Collects the output pages.
+    Without chunk_size everything stays in one PdfWriter until close().
+    With chunk_size every chunk_size pages are flushed to a temporary chunk PDF,
+    and close() concatenates the chunks, so only one chunk is held in memory.
+    output: path or binary file object.
+    chunk_dir, done_chunks: keep the chunks in chunk_dir instead of a temporary
+    folder (checkpoints) and continue after done_chunks chunks already there.
+    The folder is only removed once the final PDF has been written.
+    """
+    
+    def __init__(self, output, chunk_size=None, chunk_dir=None, done_chunks=0):
+        self.output = output
+        self.chunk_size = chunk_size
+        self.chunk_paths = []
+        self.persistent = chunk_dir is not None
+        self._chunk_dir = chunk_dir
+        self._pages_in_chunk = 0
+        self._new_writer()
+        
+        if chunk_dir:
+            self.chunk_paths = [self._chunk_path(n) for n in range(done_chunks)]
+        elif chunk_size:
+            out_dir = None
+            if isinstance(output, (str, os.PathLike)):
+                out_dir = os.path.dirname(os.path.abspath(output))
+            self._chunk_dir = tempfile.mkdtemp(prefix=".chunks-", dir=out_dir)
+    
+    def _new_writer(self):
+        self.writer = PdfWriter()
+        self.stamper = ReferenceStamper(self.writer)
+        self._pages_in_chunk = 0
+    
+    def _chunk_path(self, number):
+        return os.path.join(self._chunk_dir, f"chunk_{number:05d}.pdf")
+    
+    def _flush_chunk(self):
+        chunk_path = self._chunk_path(len(self.chunk_paths))
+        # Write under a temporary name so a crash never leaves a truncated chunk behind
+        with open(f"{chunk_path}.tmp", 'wb') as f:
+            self.writer.write(f)
+        os.replace(f"{chunk_path}.tmp", chunk_path)
+        self.chunk_paths.append(chunk_path)
+        self._new_writer()
+    
+    def add_page(self, page):
+        """Add a page and return the writer's copy (stamp that one)"""
+        # Flush lazily so the previous page could still be stamped after add_page
+        if self.chunk_size and self._pages_in_chunk >= self.chunk_size:
+            self._flush_chunk()
+        self._pages_in_chunk += 1
+        return self.writer.add_page(page)
+    
+    def close(self):
+        """Write the final PDF"""
+        if not self.chunk_size:
+            self.writer.write(self.output)
+            return
+        
+        try:
+            if self._pages_in_chunk:
+                self._flush_chunk()
+            concatenate_pdfs(self.chunk_paths, self.output)
+        except BaseException:
+            # Checkpoint chunks survive a failed run; temporary ones don't
+            if not self.persistent:
+                shutil.rmtree(self._chunk_dir, ignore_errors=True)
+            raise
+        shutil.rmtree(self._chunk_dir, ignore_errors=True)
+
+# Client PDFs of the clients split that are open at the same time
+MAX_OPEN_CLIENT_OUTPUTS = 64
+
+class ClientOutputs:
+    """
+    The per-client PDFs of the clients split, filled while the pages are processed.
+    At most max_open PdfOutputs are open; the least recently used one is closed
+    when another client needs a writer, and its file is set aside as a part.
+    close() merges each client's parts, so a client whose writer stayed open
+    the whole run is written exactly as by a single PdfOutput.
+    """
+    
+    def __init__(self, folder, chunk_size=None, max_open=MAX_OPEN_CLIENT_OUTPUTS):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.max_open = max_open
+        self.pages = {}             # client PDF path -> page count
+        self._paths = {}            # client name -> PDF path
+        self._taken = set()         # lower-cased file names in use, see client_file_name()
+        self._open = OrderedDict()  # PDF path -> PdfOutput, least recently used first
+        self._parts = {}            # PDF path -> part files of writers closed early
+        self._part_dir = None
+    
+    def output_for(self, client_name):
+        """PdfOutput for the next page of this client"""
+        path = self._paths.get(client_name)
+        if path is None:
+            path = self._paths[client_name] = os.path.join(
+                self.folder, client_file_name(client_name, self._taken))
+            self.pages[path] = 0
+        
+        out = self._open.get(path)
+        if out is None:
+            if len(self._open) >= self.max_open:
+                self._set_aside(*self._open.popitem(last=False))
+            out = self._open[path] = PdfOutput(path, self.chunk_size)
+        else:
+            self._open.move_to_end(path)
+        self.pages[path] += 1
+        return out
+    
+    def _set_aside(self, path, out):
+        """Close a writer and move what it wrote out of the way as the client's next part"""
+        out.close()
+        if self._part_dir is None:
+            self._part_dir = tempfile.mkdtemp(prefix=".parts-", dir=self.folder)
+        part = os.path.join(self._part_dir, f"part_{sum(map(len, self._parts.values())):06d}.pdf")
+        os.replace(path, part)
+        self._parts.setdefault(path, []).append(part)
+    
+    def close(self):
+        """Write every client PDF"""
+        try:
+            while self._open:
+                path, out = self._open.popitem(last=False)
+                if path in self._parts:
+                    self._set_aside(path, out)
+                else:
+                    out.close()
+            for path, parts in self._parts.items():
+                concatenate_pdfs(parts, path)
+        finally:
+            if self._part_dir:
+                shutil.rmtree(self._part_dir, ignore_errors=True)
+
+# Largest object (serialized) that concatenate_pdfs checks for duplicates
+DEDUPE_MAX_BYTES = 512
+
+def _dedupe_key(obj):
+    """
+    Content key for a small object without references (fonts, the stamp's "q"
+    stream, ...), so copies from different chunks can share one output object.
+    None for anything else.
+    """
+    if not isinstance(obj, DictionaryObject):
+        return None
+    if isinstance(obj, StreamObject) and len(obj._data) > DEDUPE_MAX_BYTES:
+        return None
+    
+    def has_references(value):
+        if isinstance(value, IndirectObject):
+            return True
+        if isinstance(value, DictionaryObject):
+            return any(has_references(v) for v in value.values())
+        if isinstance(value, ArrayObject):
+            return any(has_references(v) for v in value)
+        return False
+    
+    if has_references(obj):
+        return None
+    data = BytesIO()
+    obj.write_to_stream(data)
+    if data.tell() > DEDUPE_MAX_BYTES:
+        return None
+    return hashlib.sha256(data.getvalue()).digest()
+
+def concatenate_pdfs(input_paths, output):
+    """
+    Concatenate the pages of several PDFs, writing objects straight to the output
+    (path or binary file object).
+    Only one input is parsed at a time, so memory is bounded by the largest
+    input instead of the whole output (PdfWriter keeps every object until write).
+    Small identical objects without references (the stamp font, shared streams)
+    are written once for all inputs.
+    Document-level data (outlines, forms) is not carried over, as with add_page.
+    """
+    catalog_num, pages_num = 1, 2
+    offsets = {}
+    kids = []
+    next_num = pages_num + 1
+    shared = {}     # _dedupe_key -> number in the output
+    
+    if isinstance(output, (str, os.PathLike)):
+        target = open(output, 'wb')
+    else:
+        target = contextlib.nullcontext(output)
+    
+    with target as out:
+        start = out.tell()
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        
+        def write_object(num, obj):
+            offsets[num] = out.tell() - start
+            out.write(f"{num} 0 obj\n".encode('ascii'))
+            obj.write_to_stream(out)
+            out.write(b"\nendobj\n")
+        
+        def copy_input(path):
+            """Write the pages of one input and every object they reference"""
+            reader = PdfReader(path)    # released (with the closures below) on return
+            numbers = {}    # (idnum, generation) in this input -> number in the output
+            pending = deque()
+            
+            def renumber(ref, page=False):
+                nonlocal next_num
+                key = (ref.idnum, ref.generation)
+                if key not in numbers:
+                    content_key = None if page else _dedupe_key(reader.get_object(ref))
+                    if content_key is not None and content_key in shared:
+                        numbers[key] = shared[content_key]
+                    else:
+                        numbers[key] = next_num
+                        next_num += 1
+                        pending.append(ref)
+                        if content_key is not None:
+                            shared[content_key] = numbers[key]
+                return IndirectObject(numbers[key], 0, None)
+            
+            def remap(obj):
+                if isinstance(obj, IndirectObject):
+                    return renumber(obj)
+                if isinstance(obj, StreamObject):
+                    copy = obj.__class__()
+                    copy._data = obj._data
+                    for key, value in obj.items():
+                        if key != "/Length":
+                            copy[NameObject(key)] = remap(value)
+                    return copy
+                if isinstance(obj, DictionaryObject):
+                    return DictionaryObject({NameObject(k): remap(v) for k, v in obj.items()})
+                if isinstance(obj, ArrayObject):
+                    return ArrayObject(remap(v) for v in obj)
+                return obj
+            
+            # Number the pages first so references to them resolve to the new page objects
+            page_keys = set()
+            for page in reader.pages:
+                kids.append(renumber(page.indirect_reference, page=True))
+                page_keys.add((page.indirect_reference.idnum, page.indirect_reference.generation))
+            
+            while pending:
+                ref = pending.popleft()
+                obj = reader.get_object(ref)
+                if obj is None:
+                    write_object(numbers[(ref.idnum, ref.generation)], NullObject())
+                    continue
+                if (ref.idnum, ref.generation) in page_keys:
+                    obj = DictionaryObject({k: v for k, v in obj.items() if k != "/Parent"})
+                    obj = remap(obj)
+                    obj[NameObject("/Parent")] = IndirectObject(pages_num, 0, None)
+                else:
+                    obj = remap(obj)
+                write_object(numbers[(ref.idnum, ref.generation)], obj)
+        
+        for path in input_paths:
+            copy_input(path)
+        
+        write_object(pages_num, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(kids),
+            NameObject("/Count"): NumberObject(len(kids))
+        }))
+        write_object(catalog_num, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(pages_num, 0, None)
+        }))
+        
+        xref_offset = out.tell() - start
+        out.write(f"xref\n0 {next_num}\n".encode('ascii'))
+        out.write(b"0000000000 65535 f\r\n")
+        for num in range(1, next_num):
+            out.write(f"{offsets[num]:010d} 00000 n\r\n".encode('ascii'))
+        out.write(f"trailer\n<< /Size {next_num} /Root {catalog_num} 0 R >>\n"
+                  f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+CHECKPOINT_CHUNK_PAGES = 500
+
+class CheckpointJournal:
+    """
+    Crash-safe progress of one stamping run, kept in <output>.partial/:
+    meta.json identifies the input, the shipment data, the scan options and the
+    chunk size, journal.jsonl gets one line per processed page (match decision
+    and stamp result), and the output
+    chunks are the checkpoints. A resumed run reuses the flushed chunks as they
+    are and the journalled decisions of later pages, so no page is extracted
+    twice and the final PDF is the same as from an uninterrupted run.
+    """
+    
+    def __init__(self, output_pdf_path, source, chunk_size, total_pages, mapping_key=None, scan=None):
+        """
+        mapping_key: source_key of the shipment index; scan: LabelStamper scan options.
+        Journalled decisions are only reused when both are unchanged.
+        """
+        self.dir = f"{output_pdf_path}.partial"
+        self.path = os.path.join(self.dir, "journal.jsonl")
+        self.chunk_size = chunk_size
+        # Round-trip through JSON so it compares equal to the meta.json read back
+        self.meta = json.loads(json.dumps({
+            'input_sha256': PageTextCache.file_hash(source),
+            'mapping': mapping_key,
+            'scan': scan or {},
+            'chunk_size': chunk_size,
+            'total_pages': total_pages
+        }))
+        self.entries = {}   # page index -> {'match': ..., 'stamped': ...}
+        self.done_chunks = 0
+        self._file = None
+    
+    def open(self, resume):
+        """
+        Start the journal; with resume, load what a previous run left behind.
+        Returns the number of pages already in flushed chunks.
+        """
+        meta_path = os.path.join(self.dir, "meta.json")
+        previous = None
+        if resume:
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                previous = None
+        
+        if previous != self.meta:
+            # Nothing (usable) to resume from: start a fresh checkpoint folder
+            shutil.rmtree(self.dir, ignore_errors=True)
+            os.makedirs(self.dir)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f)
+        else:
+            self._load()
+        
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return min(self.done_chunks * self.chunk_size, self.meta['total_pages'])
+    
+    def _load(self):
+        try:
+            with open(self.path, 'r+b') as f:
+                complete = 0    # end of the last complete record
+                for line in f:
+                    try:
+                        entry = json.loads(line) if line.endswith(b"\n") else None
+                    except ValueError:
+                        entry = None
+                    if entry is None:
+                        # Last line cut off by the crash: drop it so new records start on a fresh line
+                        f.truncate(complete)
+                        break
+                    self.entries[entry['page']] = entry
+                    complete += len(line)
+        except OSError:
+            pass
+        
+        while os.path.exists(os.path.join(self.dir, f"chunk_{self.done_chunks:05d}.pdf")):
+            self.done_chunks += 1
+        # A chunk only counts if every one of its pages is journalled
+        while self.done_chunks and any(i not in self.entries for i in range(
+                min(self.done_chunks * self.chunk_size, self.meta['total_pages']))):
+            self.done_chunks -= 1
+    
+    def known_matches(self):
+        return {i: entry['match'] for i, entry in self.entries.items()}
+    
+    def record(self, page_index, match, stamped):
+        if page_index in self.entries:
+            return
+        self._file.write(json.dumps({'page': page_index, 'match': match, 'stamped': stamped},
+                                    ensure_ascii=False) + "\n")
+        self._file.flush()
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+def load_index_verbose(mapping_csv_path, db_path=None):
+    """
+    Load the shipment CSV with the STEP 1 console output; returns None on failure.
+    db_path: ingest the CSV into this ShipmentDatabase and look up shipments there.
+    """
+    print("\n" + "="*60)
+    print("📖 STEP 1: Reading mapping CSV (New Format)")
+    print("="*60)
+    
+    if db_path:
+        return load_database_verbose(db_path, [mapping_csv_path] if mapping_csv_path else [])
+    
+    try:
+        index = load_shipment_index(mapping_csv_path)
+    except Exception as e:
+        print(f"❌ Critical error reading CSV: {e}")
+        return None
+    
+    if len(index) == 0:
+        print("❌ Could not read any valid data from CSV.")
+        return None
+    
+    print(f"✓ Detected CSV encoding: {index.encoding}")
+    if index.fallback_row:
+        print(f"⚠️ Rows from {index.fallback_row} on did not decode with the first guess; "
+              f"read as {index.encoding}")
+    print(f"✓ Loaded {len(index)} orders in {index.load_seconds:.2f}s.")
+    print(f"✓ Name index built: {len(index.name_index)} client names.")
+    return index
+
+def load_database_verbose(db_path, mapping_csv_paths):
+    """Open the shipment database and ingest new CSVs, with console output; returns None on failure"""
+    try:
+        db = ShipmentDatabase(db_path)
+        for mapping_csv_path in mapping_csv_paths:
+            rows = db.ingest(mapping_csv_path)
+            if rows is None:
+                print(f"✓ {Path(mapping_csv_path).name}: already in the database")
+            else:
+                print(f"✓ {Path(mapping_csv_path).name}: {rows} rows ingested "
+                      f"({db.encoding}) in {db.load_seconds:.2f}s.")
+    except Exception as e:
+        print(f"❌ Critical error updating shipment database: {e}")
+        return None
+    
+    if len(db) == 0:
+        print("❌ The shipment database has no orders yet.")
+        return None
+    
+    print(f"✓ Shipment database {db_path}: {len(db)} orders, {db.name_count()} client names.")
+    return db
+
+SPLIT_ROUTES = ('unmatched', 'warnings', 'clients')
+
+def client_file_name(client_name, taken=None):
+    """
+    File-system safe PDF name for a client.
+    taken: lower-cased names already given to other clients; a name that would
+    collide with one of them (after sanitizing, or only differing in case, which
+    is the same file on Windows/macOS) gets a " (2)", " (3)", ... suffix and is added.
+    """
+    safe = re.sub(r'[^\w\-. ]+', '_', client_name or '').strip(' ._')[:100] or 'unknown'
+    name = f"{safe}.pdf"
+    if taken is not None:
+        number = 2
+        while name.lower() in taken:
+            name = f"{safe} ({number}).pdf"
+            number += 1
+        taken.add(name.lower())
+    return name
+
+def split_output_paths(output_pdf_path, routes):
+    """
+    Paths of the extra outputs next to the main one:
+    <name>_unmatched.pdf, <name>_warnings.pdf and a <name>_clients/ folder.
+    """
+    base = os.path.splitext(output_pdf_path)[0]
+    paths = {}
+    for route in routes:
+        if route == 'clients':
+            paths[route] = f"{base}_clients"
+        else:
+            paths[route] = f"{base}_{route}.pdf"
+    return paths
+
+class LabelStamper:
+    """
+    Headless stamping API: match every page of a label PDF against a prebuilt
+    ShipmentIndex and stamp the reference numbers. No GUI, no console output
+    unless a log callable is given.
+    
+        stamper = LabelStamper(load_shipment_index("mapping.csv"), workers=4)
+        result = stamper.stamp(pdf_bytes)
+        result['pdf']      # stamped PDF bytes
+        result['stats']    # counts per match method / verification
+        result['pages']    # per-page status, method, ref, expected name
+    """
+    
+    METHOD_STATS = {
+        "PostOne ID": 'postone',
+        "Tracking": 'tracking',
+        "Client Name Search": 'name_search'
+    }
+    
+    def __init__(self, index, workers=None, chunk_size=None, cache=None, scan=None, log=None,
+                 lazy_input=False, resume=False):
+        """
+        index: ShipmentIndex (see load_shipment_index / from_csv).
+        workers: number of processes for text extraction and matching (None/1 = serial).
+        chunk_size: streaming mode, flush output every chunk_size pages (None = keep all in memory);
+            implies lazy_input, since pypdf's page list would otherwise keep every input page.
+        cache: PageTextCache; reruns on the same PDF skip text extraction.
+        scan: {'fast': bool, 'roi': (x0, y0, x1, y1), 'backend': name} identifier scan options,
+            see analyze_page(); backend is a TEXT_BACKENDS name or 'auto' (calibrate per input).
+        log: callable receiving progress lines (e.g. print); silent by default.
+        lazy_input: memory-map input files and resolve pages lazily (see LazyPages).
+        resume: continue from the CheckpointJournal a crashed run left next to the output.
+            Runs with resume or chunk_size always keep one (path outputs only).
+        """
+        self.index = index
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.scan = scan
+        self.log = log or (lambda message: None)
+        self.lazy_input = lazy_input or bool(chunk_size)
+        self.resume = resume
+    
+    @classmethod
+    def from_csv(cls, mapping_csv, **options):
+        """Build the index from a CSV path or CSV bytes; raises ValueError if it has no rows"""
+        index = load_shipment_index(mapping_csv)
+        if len(index) == 0:
+            raise ValueError("Could not read any valid data from CSV.")
+        return cls(index, **options)
+    
+    def _stamp_page(self, output, page, writer_page, ref):
+        """Stamp one page; returns False if neither direct stamping nor the overlay worked"""
+        try:
+            output.stamper.stamp(writer_page, ref)
+            return True
+        except Exception as e:
+            # Fall back to the reportlab overlay for pages we can't stamp directly
+            self.log(f"   ⚠️ Direct stamp failed ({e}), using overlay")
+        try:
+            overlay = create_reference_overlay(ref, float(page.mediabox.width), float(page.mediabox.height))
+            writer_page.merge_page(PdfReader(overlay).pages[0])
+            return True
+        except Exception as e:
+            self.log(f"   ❌ Error stamping PDF: {e}")
+            return False
+    
+    def stamp(self, pdf, output=None, profile=None, split=None):
+        """
+        Stamp a label PDF.
+        pdf: path or PDF bytes.
+        output: path or binary file object; None returns the PDF bytes in result['pdf'].
+        profile: RunProfile to record timings into (a new one by default).
+        split: extra outputs filled in the same pass, e.g. from split_output_paths():
+            'unmatched': path/file object for pages without a match,
+            'warnings':  path/file object for matched pages that failed name verification,
+            'clients':   folder that gets one PDF per client name (see ClientOutputs).
+        An extra output is only created once a page is routed to it.
+        Returns {'pdf', 'total_pages', 'stats', 'pages', 'split', 'profile'};
+        'split' maps each written extra output (path or file object) to its page count.
+        """
+        log = self.log
+        profile = profile or RunProfile()
+        buffer = BytesIO() if output is None else None
+        split = split or {}
+        routes = {}         # extra output target -> PdfOutput, opened on the first page
+        route_pages = {}
+        clients = ClientOutputs(split['clients'], self.chunk_size) if split.get('clients') else None
+        
+        def route(target, page, ref, stamped_page=None):
+            routed = routes.get(target)
+            if routed is None:
+                routed = routes[target] = PdfOutput(target, self.chunk_size)
+                route_pages[target] = 0
+            self._copy_page(routed, page, ref, stamped_page)
+            route_pages[target] += 1
+        
+        if split.get('clients'):
+            os.makedirs(split['clients'], exist_ok=True)
+        
+        log("\n" + "="*60)
+        log("🔨 STEP 2: Processing PDF Labels")
+        log("="*60)
+        
+        total_pages = count_pages(pdf, self.lazy_input)
+        chunk_size = self.chunk_size
+        journal = None
+        done_pages = 0
+        known_matches = None
+        if (self.resume or chunk_size) and isinstance(output, (str, os.PathLike)):
+            # Chunks are the checkpoints, so checkpointing always streams
+            chunk_size = chunk_size or CHECKPOINT_CHUNK_PAGES
+            journal = CheckpointJournal(output, pdf, chunk_size, total_pages,
+                                        getattr(self.index, 'source_key', None), self.scan)
+            done_pages = journal.open(resume=self.resume)
+            known_matches = journal.known_matches()
+            if known_matches:
+                log(f"♻️  Resuming: {done_pages} pages already written, "
+                    f"{len(known_matches)} page decisions in the journal")
+            out = PdfOutput(output, chunk_size, journal.dir, journal.done_chunks)
+        else:
+            out = PdfOutput(buffer if buffer is not None else output, chunk_size)
+        
+        stats = {
+            'postone': 0,
+            'tracking': 0,
+            'name_search': 0,
+            'unmatched': 0,
+            'verified': 0,
+            'verification_failed': 0
+        }
+        
+        scan = self.scan
+        if scan and scan.get('backend') == 'auto':
+            sample_pages = scan.get('calibrate_pages') or 10
+            log(f"⚙️  Calibrating text backends on {min(sample_pages, total_pages)} pages:")
+            with profile.stage('calibrate'):
+                backend = calibrate_text_backends(pdf, sample_pages, scan.get('roi'), log)
+            scan = dict(scan, backend=backend)
+        backend_name = make_text_backend((scan or {}).get('backend'), pdf).name
+        if scan and scan.get('backend'):
+            log(f"⚙️  Text backend: {backend_name}")
+        if self.workers and self.workers > 1:
+            log(f"⚙️  Parallel mode: {self.workers} worker processes")
+        if chunk_size:
+            log(f"⚙️  Streaming mode: flushing every {chunk_size} pages")
+        if scan and scan.get('fast') and scan.get('roi'):
+            log("⚙️  Fast scan off: content strings carry no position to check against the region")
+        elif scan and scan.get('fast'):
+            log("⚙️  Fast scan: matching from content strings, full text only when needed")
+        if scan and scan.get('roi'):
+            log(f"⚙️  IDs read from region {tuple(scan['roi'])}")
+        if self.lazy_input:
+            log("⚙️  Lazy input: memory-mapped file, pages resolved on demand")
+        
+        cached_pages = None
+        cache_hits = 0
+        if self.cache:
+            # Keyed by the backend actually used, so switching --backend never reuses another's text
+            with profile.stage('cache_load'):
+                pdf_hash = self.cache.file_hash(pdf)
+                cached_pages = self.cache.load(pdf_hash, backend_name)
+            cache_hits = sum(1 for i in cached_pages if i < total_pages)
+            log(f"🗄️  Text cache: {cache_hits}/{total_pages} pages already extracted")
+        
+        matches = iter_page_matches(pdf, total_pages, self.index, self.workers, chunk_size,
+                                    cached_pages, profile, scan, self.lazy_input, known_matches)
+        
+        for i, (page, match) in enumerate(matches):
+            # Pages in chunks flushed by an earlier run are already in the output
+            written = i < done_pages
+            
+            page_num = i + 1
+            
+            log(f"\n📄 Page {page_num}/{total_pages}:")
+            
+            found_data = match['data'] # Will hold {'ref':..., 'name':...}
+            method = match['method']
+            p_num = match['p_num']
+            
+            # --- PROCESS RESULT & VERIFY ---
+            if found_data:
+                stats[self.METHOD_STATS[method]] += 1
+                ref = found_data['ref']
+                expected_name = found_data['name']
+                is_verified = match['verified']
+                
+                status_icon = "✅" if is_verified else "⚠️"
+                verify_msg = f"Name matched: '{expected_name}'" if is_verified else f"NAME MISMATCH? Exp: '{expected_name}'"
+                
+                if is_verified:
+                    stats['verified'] += 1
+                else:
+                    stats['verification_failed'] += 1
+                
+                log(f"   {status_icon} Found via {method}: {p_num if p_num else 'N/A'}")
+                log(f"   -> REF: {ref}")
+                log(f"   -> Verification: {verify_msg}")
+                
+                # Apply Stamp
+                writer_page = None
+                if written:
+                    stamped = journal.entries[i]['stamped']
+                else:
+                    with profile.stage('add_page'):
+                        writer_page = out.add_page(page)
+                    with profile.stage('stamping'):
+                        stamped = self._stamp_page(out, page, writer_page, ref)
+                
+                with profile.stage('split_output'):
+                    if not is_verified and split.get('warnings'):
+                        route(split['warnings'], page, ref, writer_page)
+                    if clients:
+                        self._copy_page(clients.output_for(expected_name), page, ref, writer_page)
+                    
+            else:
+                log("   ❌ NO MATCH FOUND.")
+                log(f"      (Ids found: {p_num}, Tracking found: {match['tracking']})")
+                stats['unmatched'] += 1
+                if not written:
+                    with profile.stage('add_page'):
+                        out.add_page(page)
+                stamped = False
+                
+                if split.get('unmatched'):
+                    with profile.stage('split_output'):
+                        route(split['unmatched'], page, None)
+            
+            profile.add_page(page_num, match, stamped)
+            if journal:
+                journal.record(i, match, stamped)
+        
+        if journal:
+            journal.close()
+        
+        # Save Output
+        log("\n" + "="*60)
+        log("💾 STEP 3: Saving Output")
+        log("="*60)
+        
+        with profile.stage('write_output'):
+            out.close()
+            for routed in routes.values():
+                routed.close()
+            if clients:
+                clients.close()
+                route_pages.update(clients.pages)
+        if journal is None and isinstance(output, (str, os.PathLike)):
+            # A checkpoint a crashed run left for this output is obsolete now
+            shutil.rmtree(f"{output}.partial", ignore_errors=True)
+        
+        if self.cache and len(cached_pages) > cache_hits:
+            try:
+                with profile.stage('cache_save'):
+                    self.cache.save(pdf_hash, cached_pages, backend_name)
+            except OSError as e:
+                log(f"⚠️ Could not update text cache: {e}")
+        
+        return {
+            'pdf': buffer.getvalue() if buffer is not None else None,
+            'total_pages': total_pages,
+            'stats': stats,
+            'pages': profile.pages,
+            'split': route_pages,
+            'profile': profile
+        }
+    
+    def _copy_page(self, output, page, ref, stamped_page=None):
+        """
+        Add a page to an extra output: stamped_page (the main output's stamped copy)
+        as it is, or else the input page, stamped here when it has a ref.
+        """
+        if stamped_page is not None:
+            output.add_page(stamped_page)
+            return
+        writer_page = output.add_page(page)
+        if ref:
+            self._stamp_page(output, page, writer_page, ref)
+    
+    RESTAMP_STATUSES = ('unmatched', 'verification_failed')
+    
+    def restamp(self, previous_pdf, previous_pages, output=None, profile=None):
+        """
+        Correction pass over an earlier output: only the pages that were unmatched or
+        failed name verification are matched again (old stamp removed first);
+        every other page is copied through untouched with its earlier result.
+        previous_pdf: path or bytes of the earlier stamped output.
+        previous_pages: its per-page results, see load_run_report().
+        Always serial and without the text cache: these passes touch few pages.
+        Returns the same dict as stamp(), with 'redone' = number of pages matched again.
+        """
+        log = self.log
+        profile = profile or RunProfile()
+        buffer = BytesIO() if output is None else None
+        out = PdfOutput(buffer if buffer is not None else output, self.chunk_size)
+        
+        total_pages = count_pages(previous_pdf, self.lazy_input)
+        if len(previous_pages) != total_pages:
+            raise ValueError(f"The report lists {len(previous_pages)} pages, "
+                             f"the previous output has {total_pages}")
+        redo = {record['page'] - 1 for record in previous_pages
+                if record['status'] in self.RESTAMP_STATUSES}
+        
+        log("\n" + "="*60)
+        log(f"🔁 STEP 2: Re-matching {len(redo)} of {total_pages} pages")
+        log("="*60)
+        
+        stats = {
+            'postone': 0,
+            'tracking': 0,
+            'name_search': 0,
+            'unmatched': 0,
+            'verified': 0,
+            'verification_failed': 0
+        }
+        # The stamp's own "REF: ..." text must not take part in matching
+        scan = dict(self.scan or {}, backend=None)
+        records = sorted(previous_pages, key=lambda record: record['page'])
+        
+        pages = iter_input_pages(previous_pdf, total_pages, self.chunk_size, self.lazy_input)
+        for i, (page, record) in enumerate(zip(pages, records)):
+            if i not in redo:
+                with profile.stage('add_page'):
+                    out.add_page(page)
+                profile.pages.append(dict(record))
+                if record['status'] == 'unmatched':
+                    stats['unmatched'] += 1
+                else:
+                    stats[self.METHOD_STATS[record['method']]] += 1
+                    stats['verified' if record['verified'] else 'verification_failed'] += 1
+                continue
+            
+            ReferenceStamper.remove(page)
+            match, extracted, extract_seconds, match_seconds = analyze_page(page, None, self.index, scan)
+            profile.add('extract_text', extract_seconds)
+            profile.add('matching', match_seconds)
+            
+            with profile.stage('add_page'):
+                writer_page = out.add_page(page)
+            stamped = False
+            if match['data']:
+                stats[self.METHOD_STATS[match['method']]] += 1
+                stats['verified' if match['verified'] else 'verification_failed'] += 1
+                with profile.stage('stamping'):
+                    stamped = self._stamp_page(out, page, writer_page, match['data']['ref'])
+                icon = "✅" if match['verified'] else "⚠️"
+                log(f"📄 Page {i + 1}: {icon} REF: {match['data']['ref']} via {match['method']} "
+                    f"(was {record['status']})")
+            else:
+                stats['unmatched'] += 1
+                log(f"📄 Page {i + 1}: ❌ still no match")
+            profile.add_page(i + 1, match, stamped)
+        
+        log("\n" + "="*60)
+        log("💾 STEP 3: Saving Output")
+        log("="*60)
+        
+        with profile.stage('write_output'):
+            out.close()
+        
+        return {
+            'pdf': buffer.getvalue() if buffer is not None else None,
+            'total_pages': total_pages,
+            'stats': stats,
+            'pages': profile.pages,
+            'split': {},
+            'profile': profile,
+            'redone': len(redo)
+        }
+
+def process_labels(input_pdf_path, mapping_csv_path, output_pdf_path, workers=None, chunk_size=None,
+                   index=None, cache=None, report=False, scan=None, split=None, lazy_input=False,
+                   db_path=None, resume=False):
+    """
+    Stamp reference numbers onto the label PDF, with console output (CLI/GUI entry point).
+    workers, chunk_size, cache, scan, lazy_input, resume: see LabelStamper.
+    index: prebuilt ShipmentIndex; mapping_csv_path is not read when given.
+    db_path: ingest the CSV into this persistent ShipmentDatabase and match against it.
+    report: write per-stage timings and per-page results as JSON/CSV next to the output.
+    split: routes from SPLIT_ROUTES to also write next to the output (see split_output_paths).
+    """
+    profile = RunProfile()
+    
+    if index is None:
+        index = load_index_verbose(mapping_csv_path, db_path)
+        if index is None:
+            return False
+        profile.add('csv_load', index.load_seconds)
+    
+    stamper = LabelStamper(index, workers, chunk_size, cache, scan, log=print, lazy_input=lazy_input,
+                           resume=resume)
+    split_paths = split_output_paths(output_pdf_path, split) if split else None
+    result = stamper.stamp(input_pdf_path, output_pdf_path, profile, split_paths)
+    stats = result['stats']
+    total_pages = result['total_pages']
+    print_summary(stats, total_pages, output_pdf_path)
+    if split_paths:
+        for route, path in split_paths.items():
+            if route == 'clients':
+                clients = [p for p in result['split'] if os.path.dirname(p) == path]
+                if clients:
+                    print(f"   Client files:  {len(clients)} PDFs in {path}")
+            elif path in result['split']:
+                print(f"   {route.capitalize() + ':':<14} {path} ({result['split'][path]} pages)")
+    
+    if report:
+        write_report(profile, output_pdf_path, {
+            'input_pdf': os.path.abspath(input_pdf_path),
+            'mapping_csv': os.path.abspath(mapping_csv_path) if mapping_csv_path else None,
+            'output_pdf': os.path.abspath(output_pdf_path),
+            'workers': workers or 1,
+            'chunk_size': chunk_size,
+            'total_pages': total_pages,
+            'stats': stats
+        })
+    
+    return True
+
+def print_summary(stats, total_pages, output_pdf_path):
+    print("\n📊 SUMMARY REPORT:")
+    print(f"   Total Pages: {total_pages}")
+    print(f"   Matched by PostOne (R/P): {stats['postone']}")
+    print(f"   Matched by Tracking:      {stats['tracking']}")
+    print(f"   Matched by Name Search:   {stats['name_search']}")
+    print("   -------------------------")
+    print(f"   ✅ Name Verification Passed: {stats['verified']}")
+    print(f"   ⚠️ Name Verification Warning: {stats['verification_failed']}")
+    print(f"   ❌ Unmatched Pages:          {stats['unmatched']}")
+    print(f"\n   File saved to: {output_pdf_path}")
+
+def write_report(profile, output_pdf_path, summary):
+    json_path, csv_path = profile.write(output_pdf_path, summary)
+    print("\n⏱️  STAGE TIMINGS:")
+    for name, entry in profile.stages.items():
+        print(f"   {name:<14} {entry['seconds']:8.3f}s  ({entry['calls']} calls)")
+    print(f"   Report saved to: {json_path}")
+    print(f"                    {csv_path}")
+
+def restamp_labels(previous_pdf_path, mapping_csv_path, output_pdf_path, report_path=None,
+                   index=None, scan=None, lazy_input=False, chunk_size=None, db_path=None):
+    """
+    Correction pass with console output: match only the pages of an earlier output
+    that its report lists as unmatched or failing verification, against an updated CSV.
+    report_path: the earlier run's JSON/CSV report (default: the one next to previous_pdf_path).
+    The new report is always written, so passes can be chained.
+    """
+    if report_path is None:
+        report_path = next((p for p in report_paths(previous_pdf_path) if os.path.exists(p)), None)
+        if report_path is None:
+            print(f"❌ No report next to {previous_pdf_path}; run with --report first or pass it to --restamp")
+            return False
+    try:
+        previous_pages = load_run_report(report_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Could not read report {report_path}: {e}")
+        return False
+    
+    profile = RunProfile()
+    if index is None:
+        index = load_index_verbose(mapping_csv_path, db_path)
+        if index is None:
+            return False
+        profile.add('csv_load', index.load_seconds)
+    
+    stamper = LabelStamper(index, chunk_size=chunk_size, scan=scan, log=print, lazy_input=lazy_input)
+    try:
+        result = stamper.restamp(previous_pdf_path, previous_pages, output_pdf_path, profile)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return False
+    
+    print_summary(result['stats'], result['total_pages'], output_pdf_path)
+    print(f"   Re-matched {result['redone']} pages, copied {result['total_pages'] - result['redone']} through")
+    write_report(profile, output_pdf_path, {
+        'input_pdf': os.path.abspath(previous_pdf_path),
+        'previous_report': os.path.abspath(report_path),
+        'mapping_csv': os.path.abspath(mapping_csv_path) if mapping_csv_path else None,
+        'output_pdf': os.path.abspath(output_pdf_path),
+        'workers': 1,
+        'chunk_size': chunk_size,
+        'total_pages': result['total_pages'],
+        'stats': result['stats']
+    })
+    return True
+
+# --- Batch / watch mode ---
+
+def find_input_pdfs(source):
+    """PDF files in a directory, or the files matching a glob pattern"""
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "*.pdf")
+    else:
+        pattern = source
+    return sorted(p for p in glob.glob(pattern) if p.lower().endswith('.pdf') and os.path.isfile(p))
+
+_batch_state = {}
+
+def _init_batch_worker(index, options):
+    """The shipment index is sent once per worker, not once per file"""
+    _batch_state['index'] = index
+    _batch_state['options'] = options
+
+def _process_batch_file(pdf_path, output_path):
+    """Stamp one file in a batch worker; returns (ok, captured console output)"""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            ok = process_labels(pdf_path, None, output_path, index=_batch_state['index'],
+                                **_batch_state['options'])
+        except Exception as e:
+            print(f"❌ Failed to process {pdf_path}: {e}")
+            ok = False
+    return ok, log.getvalue()
+
+def make_batch_pool(index, jobs, options=None):
+    """options: process_labels keyword arguments used for every file"""
+    return ProcessPoolExecutor(max_workers=jobs,
+                               initializer=_init_batch_worker,
+                               initargs=(index, options or {}))
+
+def run_batch_files(pool, pdf_paths, out_dir=None, quiet=False):
+    """
+    Stamp several PDFs concurrently on an existing batch pool.
+    Each file's console output is printed in one piece when it finishes.
+    A worker process that dies (out of memory, native crash) breaks the whole pool
+    and takes every unfinished file with it; those are returned separately, since
+    only one of them caused it (see run_isolated).
+    Returns ({pdf_path: output_path or None on failure}, [pdf paths lost to a broken pool]).
+    """
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    
+    futures = {}
+    broken = []
+    for pdf_path in pdf_paths:
+        output_path = labeled_output_path(pdf_path, out_dir)
+        try:
+            futures[pool.submit(_process_batch_file, pdf_path, output_path)] = (pdf_path, output_path)
+        except BrokenExecutor:
+            broken.append(pdf_path)
+    
+    results = {}
+    for future in as_completed(futures):
+        pdf_path, output_path = futures[future]
+        try:
+            ok, log = future.result()
+        except BrokenExecutor:
+            broken.append(pdf_path)
+            continue
+        except Exception as e:
+            ok, log = False, f"❌ Worker crashed on {pdf_path}: {e}\n"
+        if not quiet:
+            print(f"\n{'#'*60}\n📁 {Path(pdf_path).name}\n{'#'*60}")
+            print(log, end='')
+        results[pdf_path] = output_path if ok else None
+    return results, broken
+
+def run_isolated(index, options, pdf_paths, out_dir=None, quiet=False):
+    """
+    Retry files lost to a broken pool, each in a fresh single-process pool, so
+    only a file that kills its own worker again fails.
+    Returns {pdf_path: output_path or None on failure}.
+    """
+    results = {}
+    for pdf_path in pdf_paths:
+        with make_batch_pool(index, 1, options) as pool:
+            file_results, broken = run_batch_files(pool, [pdf_path], out_dir, quiet)
+        if broken:
+            print(f"❌ Worker process died on {pdf_path}")
+            file_results[pdf_path] = None
+        results.update(file_results)
+    return results
+
+def process_batch(source, mapping_csv_path, out_dir=None, jobs=None, quiet=False, db_path=None, **options):
+    """
+    Stamp every PDF in a directory/glob against one shipment index.
+    options: process_labels keyword arguments (chunk_size, cache, report, scan, split, lazy_input, resume).
+    db_path: match against this persistent ShipmentDatabase (the CSV is ingested first).
+    """
+    pdf_paths = find_input_pdfs(source)
+    if not pdf_paths:
+        print(f"❌ No PDF files found in {source}")
+        return False
+    
+    index = load_index_verbose(mapping_csv_path, db_path)
+    if index is None:
+        return False
+    
+    jobs = jobs or os.cpu_count() or 1
+    print(f"\n📦 BATCH MODE: {len(pdf_paths)} files, {jobs} parallel jobs")
+    
+    started = time.perf_counter()
+    with make_batch_pool(index, jobs, options) as pool:
+        results, broken = run_batch_files(pool, pdf_paths, out_dir, quiet=quiet)
+    if broken:
+        print(f"\n⚠️ A worker process died; retrying {len(broken)} files one at a time")
+        results.update(run_isolated(index, options, broken, out_dir, quiet))
+    
+    failed = [p for p, out in results.items() if out is None]
+    print(f"\n📊 BATCH SUMMARY: {len(results) - len(failed)}/{len(results)} files stamped "
+          f"in {time.perf_counter() - started:.1f}s")
+    for pdf_path in failed:
+        print(f"   ❌ Failed: {pdf_path}")
+    return not failed
+
+def watch_folder(inbox, mapping_csv_path, out_dir=None, jobs=None, interval=5.0, db_path=None, **options):
+    """
+    Stamp new PDFs as they land in the inbox folder (Ctrl+C to stop).
+    A file is picked up once its size and mtime are unchanged between two polls.
+    Originals are moved to inbox/processed (or inbox/failed); the CSV is
+    reloaded whenever it changes on disk. A pool broken by a dying worker is
+    replaced, and the files it took down are retried one at a time.
+    options, db_path: as for process_batch(); mapping_csv_path may be None with db_path.
+    """
+    out_dir = out_dir or os.path.join(inbox, "labeled")
+    processed_dir = os.path.join(inbox, "processed")
+    failed_dir = os.path.join(inbox, "failed")
+    for folder in (out_dir, processed_dir, failed_dir):
+        os.makedirs(folder, exist_ok=True)
+    
+    jobs = jobs or os.cpu_count() or 1
+    index = None
+    csv_mtime = None
+    pool = None
+    last_seen = {}  # pdf path -> (size, mtime) at the previous poll
+    
+    print(f"\n👀 WATCH MODE: {inbox} -> {out_dir} (every {interval:g}s, Ctrl+C to stop)")
+    
+    try:
+        while True:
+            # (Re)load the mapping when the CSV changes
+            if mapping_csv_path:
+                try:
+                    mtime = os.path.getmtime(mapping_csv_path)
+                except OSError:
+                    mtime = None
+            else:
+                mtime = 0   # --db alone: loaded once
+
+            if mtime is not None and mtime != csv_mtime:
+                new_index = load_index_verbose(mapping_csv_path, db_path)
+                if new_index is not None:
+                    index, csv_mtime = new_index, mtime
+                    if pool:
+                        pool.shutdown()
+                    pool = make_batch_pool(index, jobs, options)
+            
+            if pool is None:
+                time.sleep(interval)
+                continue
+            
+            ready = []
+            current = {}
+            for pdf_path in find_input_pdfs(inbox):
+                try:
+                    st = os.stat(pdf_path)
+                except OSError:
+                    continue
+                current[pdf_path] = (st.st_size, st.st_mtime)
+                if last_seen.get(pdf_path) == current[pdf_path]:
+                    ready.append(pdf_path)
+            last_seen = {p: sig for p, sig in current.items() if p not in ready}
+            
+            if ready:
+                results, broken = run_batch_files(pool, ready, out_dir)
+                if broken:
+                    print(f"⚠️ A worker process died; restarting the pool and retrying "
+                          f"{len(broken)} files one at a time")
+                    pool.shutdown(wait=False)
+                    pool = make_batch_pool(index, jobs, options)
+                    results.update(run_isolated(index, options, broken, out_dir))
+                for pdf_path, output_path in results.items():
+                    target = processed_dir if output_path else failed_dir
+                    shutil.move(pdf_path, os.path.join(target, os.path.basename(pdf_path)))
+                    if output_path:
+                        print(f"✓ {Path(pdf_path).name} -> {output_path}")
+            
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n👋 Watch mode stopped.")
+    finally:
+        if pool:
+            pool.shutdown()
+
+# --- Service mode ---
+
+def _stamp_upload(pdf_bytes):
+    """Stamp one uploaded PDF in a service worker; returns (stamped bytes, JSON-ready report)"""
+    started = time.perf_counter()
+    result = LabelStamper(_batch_state['index'], **_batch_state['options']).stamp(pdf_bytes)
+    profile = result['profile']
+    report = {
+        'total_pages': result['total_pages'],
+        'stats': result['stats'],
+        'seconds': round(time.perf_counter() - started, 4),
+        'stages': {name: round(entry['seconds'], 4) for name, entry in profile.stages.items()},
+        'pages': result['pages']
+    }
+    return result['pdf'], report
+
+def _warm_up():
+    """No-op task that makes the pool start its worker processes"""
+    return os.getpid()
+
+class StampService:
+    """
+    Long-running stamping service state: the shipment index lives in a pool of
+    worker processes and is reloaded (with a fresh pool) when the CSV changes.
+    At most max_pending uploads are queued or running; further ones wait up to
+    queue_timeout seconds for a slot and are then refused.
+    A replaced pool is shut down only after its last running request finished;
+    a pool whose worker died is rebuilt and the upload retried once.
+    """
+    
+    def __init__(self, mapping_csv_path, jobs=None, max_pending=None, queue_timeout=30.0, db_path=None,
+                 **options):
+        self.mapping_csv_path = mapping_csv_path
+        self.db_path = db_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.options = options  # LabelStamper keyword arguments (chunk_size, cache, scan)
+        self.slots = threading.BoundedSemaphore(max_pending or self.jobs * 2)
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_state = 'ok'   # 'ok', 'rebuilding' or 'broken'
+        self.last_failure = None # {'at': ISO time, 'error': message} of the last dead worker
+        self.pool_users = {}     # pool -> requests currently using it
+        self.retired = set()     # replaced pools waiting for their last request
+        self.index = None
+        self.csv_mtime = None
+        self.loaded_at = None
+    
+    def reload_if_changed(self):
+        """(Re)load the CSV when its mtime changed; keeps the old index if the new one fails"""
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.mapping_csv_path)
+            except OSError:
+                return
+            if mtime == self.csv_mtime:
+                return
+            
+            index = load_index_verbose(self.mapping_csv_path, self.db_path)
+            if index is None:
+                self.csv_mtime = mtime  # don't retry a broken file on every request
+                return
+            
+            pool = self._start_pool(index)
+            self._swap_pool(pool)
+            self.index, self.csv_mtime = index, mtime
+            self.pool_state = 'ok'
+            self.loaded_at = datetime.now().isoformat(timespec='seconds')
+    
+    def _start_pool(self, index):
+        """New worker pool holding index, with all workers started"""
+        pool = ProcessPoolExecutor(max_workers=self.jobs,
+                                   initializer=_init_batch_worker,
+                                   initargs=(index, self.options))
+        for future in [pool.submit(_warm_up) for _ in range(self.jobs)]:
+            future.result()
+        return pool
+    
+    def _swap_pool(self, pool):
+        """Make pool the current one (caller holds self.lock)"""
+        old_pool, self.pool = self.pool, pool
+        if old_pool is None:
+            return
+        if self.pool_users.get(old_pool):
+            # Requests already submitted still finish on the old pool
+            self.retired.add(old_pool)
+        else:
+            old_pool.shutdown(wait=False)
+    
+    def _acquire_pool(self):
+        with self.lock:
+            pool = self.pool
+            if pool is not None:
+                self.pool_users[pool] = self.pool_users.get(pool, 0) + 1
+            return pool
+    
+    def _release_pool(self, pool):
+        with self.lock:
+            self.pool_users[pool] -= 1
+            if self.pool_users[pool]:
+                return
+            del self.pool_users[pool]
+            if pool in self.retired:
+                self.retired.discard(pool)
+                pool.shutdown(wait=False)
+    
+    def _rebuild_pool(self, broken_pool):
+        """Replace a pool whose worker died, unless another request already did"""
+        with self.lock:
+            if self.pool is not broken_pool:
+                return
+            print("⚠️ A worker process died; restarting the worker pool")
+            self._record_failure("worker process died")
+            self.pool_state = 'rebuilding'
+            try:
+                pool = self._start_pool(self.index)
+            except Exception as e:
+                self.pool_state = 'broken'
+                self._record_failure(f"could not restart the worker pool: {e}")
+                raise RuntimeError(f"could not restart the worker pool: {e}")
+            self._swap_pool(pool)
+            self.pool_state = 'ok'
+    
+    def _record_failure(self, error):
+        self.last_failure = {'at': datetime.now().isoformat(timespec='seconds'), 'error': error}
+    
+    def _pool_status(self):
+        """
+        'ok', 'rebuilding' or 'broken', without submitting work to the pool.
+        A dead worker shows up here at once (the executor marks itself broken);
+        the pool itself is only rebuilt by the next upload.
+        """
+        pool = self.pool
+        if pool is None or self.pool_state != 'ok':
+            return self.pool_state
+        return 'broken' if getattr(pool, '_broken', False) else 'ok'
+    
+    def status(self):
+        # Read without self.lock so /health answers while a pool is being (re)built
+        return {
+            'status': self._pool_status() if self.index is not None else 'no_index',
+            'mapping_csv': os.path.abspath(self.mapping_csv_path),
+            'orders': len(self.index) if self.index is not None else 0,
+            'encoding': self.index.encoding if self.index is not None else None,
+            'loaded_at': self.loaded_at,
+            'jobs': self.jobs,
+            'last_failure': self.last_failure
+        }
+    
+    def stamp(self, pdf_bytes):
+        """
+        Stamp one upload; returns (stamped bytes, report).
+        Raises RuntimeError when busy, when no index could be loaded or when
+        the upload killed a worker twice.
+        """
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise RuntimeError("service busy, try again later")
+        try:
+            self.reload_if_changed()
+            for attempt in range(2):
+                pool = self._acquire_pool()
+                if pool is None:
+                    raise RuntimeError("no shipment index loaded")
+                try:
+                    return pool.submit(_stamp_upload, pdf_bytes).result()
+                except BrokenExecutor:
+                    pass
+                finally:
+                    self._release_pool(pool)
+                self._rebuild_pool(pool)
+            raise RuntimeError("a worker process died while stamping this upload")
+        finally:
+            self.slots.release()
+    
+    def close(self):
+        with self.lock:
+            for pool in self.retired | {self.pool} - {None}:
+                pool.shutdown()
+            self.pool = None
+            self.retired.clear()
+
+def read_upload(content_type, body):
+    """PDF bytes from a raw application/pdf body or the first file of a multipart form"""
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+        for part in message.iter_parts():
+            if part.get_filename() or part.get_content_type() == 'application/pdf':
+                return part.get_payload(decode=True)
+        return None
+    return body
+
+class StampRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health              -> index and worker pool status as JSON (503 unless ok)
+    POST /stamp               -> stamped PDF (match counts in the X-Match-Stats header)
+    POST /stamp?format=json   -> {"report": {...}, "pdf_base64": "..."}
+    The PDF is the raw request body or the file of a multipart form upload.
+    """
+    service = None          # StampService, set by serve()
+    max_upload_bytes = 100 * 1024 * 1024    # serve() sets it from --max-upload-mb
+    
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                   'application/json; charset=utf-8')
+    
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            status = self.service.status()
+            self._send_json(200 if status['status'] == 'ok' else 503, status)
+        else:
+            self._send_json(404, {'error': 'not found'})
+    
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/stamp':
+            self._send_json(404, {'error': 'not found'})
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self._send_json(400, {'error': 'invalid Content-Length'})
+            return
+        if length < 0:
+            self._send_json(400, {'error': 'invalid Content-Length'})
+            return
+        if length == 0:
+            self._send_json(400, {'error': 'empty upload'})
+            return
+        if length > self.max_upload_bytes:
+            self._send_json(413, {'error': 'upload too large'})
+            return
+        
+        pdf_bytes = read_upload(self.headers.get('Content-Type', ''), self.rfile.read(length))
+        if not pdf_bytes:
+            self._send_json(400, {'error': 'no PDF in upload'})
+            return
+        
+        started = time.perf_counter()
+        try:
+            stamped, report = self.service.stamp(pdf_bytes)
+        except RuntimeError as e:
+            self._send_json(503, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(422, {'error': f"could not stamp PDF: {e}"})
+            return
+        
+        stats = report['stats']
+        print(f"📨 {self.client_address[0]}: {report['total_pages']} pages in "
+              f"{time.perf_counter() - started:.2f}s "
+              f"({stats['postone'] + stats['tracking'] + stats['name_search']} matched, "
+              f"{stats['unmatched']} unmatched, {stats['verification_failed']} warnings)")
+        
+        if parse_qs(url.query).get('format') == ['json']:
+            self._send_json(200, {'report': report,
+                                  'pdf_base64': base64.b64encode(stamped).decode('ascii')})
+        else:
+            self._send(200, stamped, 'application/pdf', {
+                'X-Match-Stats': json.dumps(stats),
+                'Content-Disposition': 'attachment; filename="labeled.pdf"'
+            })
+    
+    def log_message(self, format, *args):
+        # Successful stamps are logged above; keep the default log for errors only
+        if not (len(args) > 1 and str(args[1]).startswith('2')):
+            super().log_message(format, *args)
+
+def serve(mapping_csv_path, host="127.0.0.1", port=8765, jobs=None, max_upload_mb=100, db_path=None,
+          **options):
+    """
+    Run the stamping HTTP service until Ctrl+C.
+    options: LabelStamper keyword arguments (chunk_size, cache, scan) for every upload.
+    db_path: match against this persistent ShipmentDatabase; the CSV is ingested on (re)load.
+    """
+    service = StampService(mapping_csv_path, jobs, db_path=db_path, **options)
+    service.reload_if_changed()
+    if service.index is None:
+        print("❌ Service not started: the mapping CSV could not be loaded.")
+        return False
+    
+    StampRequestHandler.service = service
+    StampRequestHandler.max_upload_bytes = max_upload_mb * 1024 * 1024
+    server = ThreadingHTTPServer((host, port), StampRequestHandler)
+    
+    print(f"\n🌐 SERVICE MODE: http://{host}:{port}/stamp ({service.jobs} workers, Ctrl+C to stop)")
+    print(f"   curl --data-binary @labels.pdf -o labeled.pdf http://{host}:{port}/stamp")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Service stopped.")
+    finally:
+        server.server_close()
+        service.close()
+    return True
+
+def parse_roi(value):
+    """argparse type for --roi: 'x0,y0,x1,y1' in PDF points"""
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected four numbers: X0,Y0,X1,Y1")
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+def parse_split(value):
+    """argparse type for --split: comma-separated names from SPLIT_ROUTES"""
+    routes = [r.strip() for r in value.split(',') if r.strip()]
+    unknown = [r for r in routes if r not in SPLIT_ROUTES]
+    if unknown or not routes:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(SPLIT_ROUTES)}")
+    return routes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add reference numbers to PostOne label PDFs")
+    parser.add_argument('input_pdf', nargs='?', help="PDF labels file")
+    parser.add_argument('mapping_csv', nargs='?', help="CSV mapping file")
+    parser.add_argument('output_pdf', nargs='?', help="Output PDF path")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Process pages in N worker processes (0 = all CPU cores)")
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='N',
+                        help="Streaming mode: flush output every N pages and read the input lazily "
+                             "(implies --mmap); memory stays roughly flat apart from the per-page report")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, metavar='DIR',
+                        help=f"Cache extracted page text between runs (default dir: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help="Evict least recently used cache files above this size")
+    parser.add_argument('--report', '--profile', dest='report', action='store_true',
+                        help="Write stage timings and per-page results as JSON/CSV next to the output")
+    parser.add_argument('--fast-scan', action='store_true',
+                        help="Match PostOne IDs from raw content strings; full text extraction only when needed "
+                             "(ignored with --roi)")
+    parser.add_argument('--backend', choices=['auto'] + list(TEXT_BACKENDS), default=None,
+                        help="Text extraction backend (default pypdf); 'auto' times the installed "
+                             "backends on the first pages and picks the fastest that finds the same IDs")
+    parser.add_argument('--calibrate-pages', type=int, default=10, metavar='N',
+                        help="Pages sampled by --backend auto")
+    parser.add_argument('--roi', type=parse_roi, metavar='X0,Y0,X1,Y1',
+                        help="Only read PostOne/tracking IDs from this box (PDF points, origin bottom-left)")
+    parser.add_argument('--restamp', nargs='?', const='', metavar='REPORT',
+                        help="input_pdf is an earlier output: only re-match its unmatched/warning pages "
+                             "(from REPORT, default the report next to it) and copy the rest through")
+    parser.add_argument('--resume', action='store_true',
+                        help="Checkpoint progress next to the output (<output>.partial/) and continue "
+                             "from the last checkpoint of a run that crashed (--chunk-size runs "
+                             "always checkpoint)")
+    parser.add_argument('--mmap', dest='lazy_input', action='store_true',
+                        help="Memory-map the input PDF and resolve pages lazily (large files)")
+    parser.add_argument('--db', dest='db_path', metavar='PATH',
+                        help="Persistent SQLite shipment index: CSVs are ingested into it and lookups "
+                             "cover every export ingested so far (mapping_csv may then be '-')")
+    parser.add_argument('--ingest', nargs='+', metavar='CSV',
+                        help="Only ingest shipment CSVs into --db and exit")
+    parser.add_argument('--split', type=parse_split, metavar='ROUTES',
+                        help="Also write unmatched/warnings pages and/or per-client PDFs next to the output, "
+                             "e.g. --split unmatched,warnings,clients")
+    parser.add_argument('--batch', metavar='DIR_OR_GLOB',
+                        help="Stamp every PDF in a folder or matching a glob (needs --csv)")
+    parser.add_argument('--watch', metavar='INBOX',
+                        help="Keep stamping new PDFs that land in the INBOX folder (needs --csv)")
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help="Run a local HTTP stamping service on PORT (needs --csv)")
+    parser.add_argument('--host', default="127.0.0.1", help="Address for --serve")
+    parser.add_argument('--max-upload-mb', type=int, default=100,
+                        help="Largest PDF accepted by --serve")
+    parser.add_argument('--csv', dest='batch_csv', help="CSV mapping file for --batch/--watch/--serve")
+    parser.add_argument('--out-dir', help="Output folder for --batch/--watch")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Files processed in parallel in --batch/--watch/--serve (default: CPU cores)")
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help="Seconds between inbox polls in --watch mode")
+    args = parser.parse_args(argv)
+    
+    workers = args.workers
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    
+    cache = PageTextCache(args.cache, args.cache_max_mb * 1024 * 1024) if args.cache else None
+    options = {
+        'chunk_size': args.chunk_size,
+        'cache': cache,
+        'report': args.report,
+        'scan': {'fast': args.fast_scan, 'roi': args.roi, 'backend': args.backend,
+                 'calibrate_pages': args.calibrate_pages},
+        'split': args.split,
+        'lazy_input': args.lazy_input,
+        'resume': args.resume
+    }
+    
+    mapping_csv = args.mapping_csv
+    if args.db_path and mapping_csv == '-':
+        mapping_csv = None
+    
+    if args.ingest:
+        if not args.db_path:
+            parser.error("--ingest needs --db PATH")
+        print(f"\n🗃️  Ingesting {len(args.ingest)} CSV files into {args.db_path}")
+        sys.exit(0 if load_database_verbose(args.db_path, args.ingest) is not None else 1)
+    elif args.serve:
+        if not args.batch_csv:
+            parser.error("--serve needs --csv mapping.csv")
+        ok = serve(args.batch_csv, args.host, args.serve, args.jobs, args.max_upload_mb,
+                   chunk_size=args.chunk_size, cache=cache, scan=options['scan'],
+                   lazy_input=args.lazy_input, db_path=args.db_path)
+        sys.exit(0 if ok else 1)
+    elif args.batch or args.watch:
+        if args.batch and not (args.batch_csv or args.db_path):
+            parser.error("--batch needs --csv mapping.csv or --db PATH")
+        if args.watch and not (args.batch_csv or args.db_path):
+            parser.error("--watch needs --csv mapping.csv or --db PATH")
+        if args.batch:
+            ok = process_batch(args.batch, args.batch_csv, args.out_dir, args.jobs,
+                               db_path=args.db_path, **options)
+            sys.exit(0 if ok else 1)
+        watch_folder(args.watch, args.batch_csv, args.out_dir, args.jobs, args.interval,
+                     db_path=args.db_path, **options)
+    elif args.restamp is not None:
+        if not (args.input_pdf and args.mapping_csv and args.output_pdf):
+            parser.error("--restamp needs previous_output.pdf mapping.csv output.pdf")
+        if os.path.abspath(args.input_pdf) == os.path.abspath(args.output_pdf):
+            parser.error("--restamp can't overwrite the output it reads from")
+        ok = restamp_labels(args.input_pdf, mapping_csv, args.output_pdf, args.restamp or None,
+                            scan=options['scan'], lazy_input=args.lazy_input,
+                            chunk_size=args.chunk_size, db_path=args.db_path)
+        sys.exit(0 if ok else 1)
+    elif args.input_pdf and args.mapping_csv and args.output_pdf:
+        process_labels(args.input_pdf, mapping_csv, args.output_pdf, workers=workers,
+                       db_path=args.db_path, **options)
+    elif args.input_pdf:
+        parser.error("input_pdf, mapping_csv and output_pdf must be given together")
+    else:
+        result = select_files_gui()
+        if result:
+            process_labels(*result, workers=workers, db_path=args.db_path, **options)
+
+if __name__ == "__main__":
+    main()
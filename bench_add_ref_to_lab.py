@@ -0,0 +1,315 @@
+"""
+Benchmark for add_ref_to_lab_v5 with synthetic PostOne labels.
+Generates label PDFs (R/P numbers, tracking codes, recipient names) and the
+matching shipment CSV, then measures pages/second and peak memory (main
+process and, with --workers, the largest worker process).
+
+Requirements:
+    pip install pypdf reportlab --break-system-packages
+
+Usage:
+    python bench_add_ref_to_lab.py                       (100, 1k and 10k pages)
+    python bench_add_ref_to_lab.py --sizes 500 5000 --workers 4 --chunk-size 500
+    python bench_add_ref_to_lab.py --tracking-rate 0.2 --name-rate 0.1 --keep bench_data/
+    python bench_add_ref_to_lab.py --sizes 1000 --check-db-names
+"""
+
+import os
+import io
+import csv
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import traceback
+import contextlib
+import multiprocessing
+from queue import Empty
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import mm
+from reportlab.graphics.barcode import code128
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+import add_ref_to_lab_v5
+
+FIRST_NAMES = ['Mario', 'Giulia', 'Luca', 'Anna', 'Paolo', 'Cinzia', 'Marco', 'Elena',
+               'Francesca', 'Giovanni', 'Chiara', 'Roberto', 'Silvia', 'Andrea', 'Laura',
+               'Stefano', 'Valentina', 'Alessandro', 'Federica', 'Matteo']
+LAST_NAMES = ['Rossi', 'Bianchi', 'Ferrari', 'Esposito', 'Romano', 'Colombo', 'Ricci',
+              'Marino', 'Greco', 'Bruno', 'Gallo', 'Conti', 'De Luca', 'Mancini', 'Costa',
+              'Giordano', 'Rizzo', 'Lombardi', 'Moretti', 'Barbieri', 'Perna', 'Fontana']
+STREETS = ['Via Roma', 'Via Garibaldi', 'Corso Italia', 'Via Mazzini', 'Viale Europa',
+           'Via Dante', 'Piazza Verdi', 'Via Cavour']
+CITIES = ['Milano', 'Roma', 'Napoli', 'Torino', 'Bologna', 'Firenze', 'Bari', 'Palermo']
+
+# Same column layout as the "Shipments-Гриин Деливери" export (name is column 6)
+CSV_HEADER = ['Номер на пратка', 'Проследяващ номер', 'Номер по референция', 'Дата',
+              'Услуга', 'Тегло', 'Име на получател', 'Град']
+
+def generate_dataset(pdf_path, csv_path, pages, tracking_rate=0.03, name_rate=0.02,
+                     unmatched_rate=0.01, mismatch_rate=0.01, seed=42):
+    """
+    Write a synthetic label PDF and its shipment CSV.
+    tracking_rate:  the CSV has no PostOne number for the label -> Tracking fallback
+    name_rate:      the CSV has neither PostOne nor tracking    -> Name fallback
+    unmatched_rate: the label is missing from the CSV entirely  -> NO MATCH
+    mismatch_rate:  the CSV name differs from the label         -> verification warning
+    """
+    rng = random.Random(seed)
+    width, height = 100 * mm, 150 * mm
+    c = canvas.Canvas(pdf_path, pagesize=(width, height))
+    rows = []
+    expected = {'postone': 0, 'tracking': 0, 'name_search': 0, 'unmatched': 0}
+
+    for i in range(pages):
+        prefix = 'R' if rng.random() < 0.8 else 'P'
+        p_number = f"{prefix}{rng.randrange(10**9, 10**10):010d}"
+        tracking = f"{rng.randrange(10**13, 10**14)}IT"
+        name = f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}"
+        city = rng.choice(CITIES)
+
+        # --- Label page ---
+        c.setLineWidth(1)
+        c.rect(3 * mm, 3 * mm, width - 6 * mm, height - 6 * mm)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(8 * mm, height - 15 * mm, "PostOne Express")
+        c.setFont("Helvetica", 8)
+        c.drawString(8 * mm, height - 22 * mm, "Mittente: Green Delivery Srl, Via Industria 12, Verona")
+        c.setFont("Helvetica", 10)
+        c.drawString(8 * mm, height - 35 * mm, "Destinatario:")
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(8 * mm, height - 41 * mm, name)
+        c.setFont("Helvetica", 10)
+        c.drawString(8 * mm, height - 47 * mm, f"{rng.choice(STREETS)} {rng.randrange(1, 200)}")
+        c.drawString(8 * mm, height - 52 * mm, f"{rng.randrange(10000, 99999)} {city} (IT)")
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(8 * mm, height - 65 * mm, f"Spedizione: {p_number}")
+        c.drawString(8 * mm, height - 72 * mm, f"Tracking: {tracking}")
+        barcode = code128.Code128(tracking, barHeight=20 * mm, barWidth=0.9)
+        barcode.drawOn(c, (width - barcode.width) / 2, 40 * mm)
+        c.setFont("Helvetica", 7)
+        c.drawString(8 * mm, 10 * mm, f"Colli: 1/1   Peso: {rng.randrange(1, 30)} kg")
+        c.showPage()
+
+        # --- Matching CSV row ---
+        roll = rng.random()
+        if roll < unmatched_rate:
+            expected['unmatched'] += 1
+            continue
+        roll -= unmatched_rate
+        csv_p_number, csv_tracking = p_number, tracking
+        if roll < name_rate:
+            csv_p_number, csv_tracking = '', ''
+            expected['name_search'] += 1
+        elif roll < name_rate + tracking_rate:
+            csv_p_number = ''
+            expected['tracking'] += 1
+        else:
+            expected['postone'] += 1
+
+        csv_name = name
+        if rng.random() < mismatch_rate:
+            csv_name = f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}"
+
+        rows.append([csv_p_number, csv_tracking, f"GD{i:07d}", "2026-01-15", "Standard",
+                     f"{rng.randrange(1, 30)}", csv_name, city])
+
+    c.save()
+
+    # Shuffle so CSV order doesn't follow page order, as in real exports
+    rng.shuffle(rows)
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+
+    return expected
+
+def _peak_rss_mb(children=False):
+    """
+    Peak RSS of this process, or with children=True of its largest finished
+    child (the --workers processes, once their pool has shut down)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _format_mb(value):
+    return f"{value:.0f} MB" if value else "n/a"
+
+def _run_child(pdf_path, csv_path, output_path, options, queue):
+    """Run process_labels in a fresh process so peak RSS belongs to this run only"""
+    log = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        try:
+            ok = add_ref_to_lab_v5.process_labels(pdf_path, csv_path, output_path, **options)
+        except Exception:
+            traceback.print_exc(file=log)
+            ok = False
+    queue.put({
+        'ok': ok,
+        'seconds': time.perf_counter() - started,
+        'peak_rss_mb': _peak_rss_mb(),
+        'worker_rss_mb': _peak_rss_mb(children=True),
+        'log': log.getvalue()
+    })
+
+def run_benchmark(pdf_path, csv_path, output_path, options):
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_run_child,
+                                    args=(pdf_path, csv_path, output_path, options, queue))
+    child.start()
+    result = None
+    while result is None:
+        exited = child.exitcode is not None
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if exited:
+                # Killed or crashed before reporting (e.g. out of memory)
+                result = {'ok': False, 'seconds': 0.0, 'peak_rss_mb': None, 'worker_rss_mb': None,
+                          'log': f"benchmark process exited with code {child.exitcode} without a result"}
+    child.join()
+    return result
+
+def check_db_name_parity(csv_path, db_path):
+    """
+    Compare the name fallback of ShipmentDatabase with NameIndex on the same CSV:
+    every name on its own, glued to neighbouring text and next to another name.
+    Returns the texts on which the two disagree.
+    """
+    index = add_ref_to_lab_v5.load_shipment_index(csv_path)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = add_ref_to_lab_v5.ShipmentDatabase(db_path)
+    db.ingest(csv_path)
+
+    rng = random.Random(0)
+    names = list(index.by_name)
+    mismatches = []
+    for name in names:
+        other = rng.choice(names)
+        for text in (f"destinatario {name} via roma", f"destinatario:{name}", f"sig.{name}x",
+                     f"{other} {name}", f"{name}{other}"):
+            if index.lookup_name(text) != db.lookup_name(text):
+                mismatches.append(text)
+    db.conn.close()
+    return mismatches
+
+def parse_summary(log):
+    """Pull the SUMMARY REPORT counters out of process_labels' console output"""
+    labels = {
+        'Matched by PostOne (R/P):': 'postone',
+        'Matched by Tracking:': 'tracking',
+        'Matched by Name Search:': 'name_search',
+        'Unmatched Pages:': 'unmatched'
+    }
+    summary = {}
+    for line in log.splitlines():
+        for label, key in labels.items():
+            if label in line:
+                summary[key] = int(line.rsplit(':', 1)[1])
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark add_ref_to_lab_v5 on synthetic labels")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help="Page counts to benchmark")
+    parser.add_argument('--tracking-rate', type=float, default=0.03,
+                        help="Fraction of labels only findable by tracking number")
+    parser.add_argument('--name-rate', type=float, default=0.02,
+                        help="Fraction of labels only findable by recipient name")
+    parser.add_argument('--unmatched-rate', type=float, default=0.01,
+                        help="Fraction of labels missing from the CSV")
+    parser.add_argument('--mismatch-rate', type=float, default=0.01,
+                        help="Fraction of CSV rows with a different recipient name")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Passed to process_labels (0 = all CPU cores)")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="Passed to process_labels (streaming mode)")
+    parser.add_argument('--fast-scan', action='store_true',
+                        help="Passed to process_labels (content-string fast path)")
+    parser.add_argument('--mmap', action='store_true',
+                        help="Passed to process_labels (memory-mapped, lazily resolved input)")
+    parser.add_argument('--check-db-names', action='store_true',
+                        help="Also check that the --db name fallback finds the same names as the CSV index")
+    parser.add_argument('--keep', metavar='DIR',
+                        help="Keep generated PDFs/CSVs and outputs in DIR")
+    args = parser.parse_args(argv)
+
+    workers = args.workers
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    options = {'workers': workers, 'chunk_size': args.chunk_size,
+               'scan': {'fast': args.fast_scan, 'roi': None}, 'lazy_input': args.mmap}
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix="bench_add_ref_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    print(f"📁 Working folder: {work_dir}")
+    print(f"⚙️  Options: workers={workers or 1}, chunk_size={args.chunk_size}, fast_scan={args.fast_scan}, mmap={args.mmap}")
+
+    results = []
+    try:
+        for pages in args.sizes:
+            pdf_path = os.path.join(work_dir, f"labels_{pages}.pdf")
+            csv_path = os.path.join(work_dir, f"shipments_{pages}.csv")
+            output_path = os.path.join(work_dir, f"labels_{pages}_labeled.pdf")
+
+            print(f"\n🏭 Generating {pages} labels...")
+            started = time.perf_counter()
+            expected = generate_dataset(pdf_path, csv_path, pages, args.tracking_rate, args.name_rate,
+                                        args.unmatched_rate, args.mismatch_rate, args.seed)
+            print(f"   done in {time.perf_counter() - started:.1f}s "
+                  f"({os.path.getsize(pdf_path) / 1024 / 1024:.1f} MB)")
+
+            if args.check_db_names:
+                mismatches = check_db_name_parity(csv_path, os.path.join(work_dir, f"shipments_{pages}.db"))
+                if mismatches:
+                    print(f"   ❌ Database name lookup differs from NameIndex on {len(mismatches)} texts, "
+                          f"e.g. {mismatches[0]!r}")
+                else:
+                    print("   ✓ Database name lookup matches NameIndex")
+
+            print(f"⏱️  Stamping {pages} pages...")
+            result = run_benchmark(pdf_path, csv_path, output_path, options)
+            if not result['ok']:
+                print("❌ process_labels failed:")
+                print(result['log'])
+                continue
+
+            summary = parse_summary(result['log'])
+            result.update(pages=pages, expected=expected, summary=summary)
+            results.append(result)
+
+            workers_rss = f", largest worker {_format_mb(result['worker_rss_mb'])}" if result['worker_rss_mb'] else ""
+            print(f"   {result['seconds']:.2f}s, {pages / result['seconds']:.1f} pages/s, "
+                  f"peak RSS {_format_mb(result['peak_rss_mb'])}{workers_rss}")
+            if summary != expected:
+                # Random recipients can share a name, so the name fallback may claim a few extra pages
+                print(f"   ℹ️ Match counts differ from the generated data: got {summary}, expected {expected}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\n📊 BENCHMARK RESULTS:")
+    print(f"   {'Pages':>7} {'Seconds':>9} {'Pages/s':>9} {'Peak RSS':>10} {'Worker RSS':>11}   "
+          f"PostOne/Tracking/Name/Unmatched")
+    for result in results:
+        s = result['summary']
+        print(f"   {result['pages']:>7} {result['seconds']:>9.2f} {result['pages'] / result['seconds']:>9.1f} "
+              f"{_format_mb(result['peak_rss_mb']):>10} {_format_mb(result['worker_rss_mb']):>11}   "
+              f"{s.get('postone')}/{s.get('tracking')}/{s.get('name_search')}/{s.get('unmatched')}")
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,36 @@ Warehouse Label Generator v3.9 - DYNAMIC BARCODES FOR MOBILE SCANNERS
 - Optimized barcode width for long SKUs (0.75-1.2 barWidth)
 - Enhanced readability for 203 DPI thermal printers
 - Mobile scanner compatibility with minimum 0.75 X-dimension
+
+Requirements:
+    pip install reportlab pandas openpyxl --break-system-packages
+    pip install pypdf --break-system-packages     (batch mode: output files of more than 25 labels)
+    tkinter for the GUI only; batch mode runs without it
+
+Batch mode (no window, labels rendered in parallel):
+    python warehouse_fix.py --batch master.xlsx [--pick-list picks.csv]
+                            [--mode label_only|both|attachment_only] [--per-client]
+                            [--out-dir DIR] [--client NAME] [--jobs N]
 """
 
-import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
 from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
+from reportlab.lib.units import mm, inch
 from reportlab.lib.colors import black
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.graphics.barcode import code128
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import os
+import io
+import gc
+import bisect
+import sys
+import marshal
+import argparse
+import functools
+import contextlib
+import numpy as np
 import pandas as pd
 
 def setup_fonts():
@@ -59,8 +77,270 @@ def setup_fonts():
     except:
         return False
 
+def normalize_sku(value):
+    """SKU as text: numbers lose the float part when whole (123.0 -> '123')"""
+    try:
+        sku_float = float(value)
+        if sku_float == int(sku_float):
+            return str(int(sku_float)).strip()
+        return str(sku_float).strip()
+    except (ValueError, TypeError):
+        return str(value).strip()
+
+def normalize_sku_column(column):
+    """normalize_sku over a whole column; numeric columns are converted without a Python loop"""
+    if not (pd.api.types.is_integer_dtype(column) or pd.api.types.is_float_dtype(column)):
+        return [normalize_sku(value) for value in column.tolist()]
+    
+    values = column.to_numpy(dtype='float64')
+    whole = np.isfinite(values) & (values == np.floor(values)) & (np.abs(values) < 2**63)
+    skus = np.empty(len(values), dtype=object)
+    skus[whole] = values[whole].astype(np.int64).astype(str).tolist()
+    # Fractions and inf/nan keep the row-by-row behaviour (inf still raises)
+    skus[~whole] = [normalize_sku(value) for value in values[~whole].tolist()]
+    return skus.tolist()
+
+def text_column(column):
+    """str(value).strip() for every cell, as the values come out of the DataFrame"""
+    return [str(value).strip() for value in column.tolist()]
+
+COLUMN_MAPPING = {
+    'Фирма': 'client',
+    'Артикул': 'sku',
+    'Име': 'name',
+    'Поз.': 'position',
+    'Поз': 'position',
+    'Client': 'client',
+    'SKU': 'sku',
+    'Name': 'name',
+    'Product': 'name',
+    'Company': 'client',
+    'Position': 'position'
+}
+
+def read_master_file(filepath):
+    """Read the Excel/CSV master file into a cleaned sku/name/client[/position] frame"""
+    if filepath.endswith('.csv'):
+        df = pd.read_csv(filepath, encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(filepath)
+    
+    df_renamed = df.rename(columns=COLUMN_MAPPING)
+    
+    if not all(col in df_renamed.columns for col in ['sku', 'name', 'client']):
+        if len(df.columns) >= 3:
+            df_renamed = df.iloc[:, :3].copy()
+            df_renamed.columns = ['client', 'sku', 'name']
+        else:
+            raise ValueError("Could not find required columns")
+    
+    df_clean = df_renamed.dropna(subset=['sku'])
+    df_clean = df_clean[df_clean['sku'].astype(str).str.strip() != '']
+    df_clean = df_clean[~df_clean['sku'].astype(str).str.lower().str.contains('общо|total|sum', na=False)]
+    return df_clean
+
+def _master_rows(df):
+    """Normalised sku/name/client/position text columns of the valid rows"""
+    rows = pd.DataFrame({
+        'sku': normalize_sku_column(df['sku']),
+        'name': text_column(df['name']),
+        'client': text_column(df['client'])
+    })
+    positions = df['position'] if 'position' in df.columns else pd.Series(np.nan, index=df.index)
+    rows['position'] = [str(value).strip() if pd.notna(value) else '' for value in positions.tolist()]
+    return rows[(rows['sku'] != '') & (rows['name'] != '') & (rows['client'] != '')]
+
+def build_master_data(df, positions_mode):
+    """
+    {sku: {'name', 'client', 'positions'}} from a cleaned sku/name/client[/position] frame.
+    Without positions the last row of a SKU wins; with positions the first row gives
+    name and client and every distinct position is collected in file order.
+    """
+    return _master_view(_master_rows(df), positions_mode)
+
+def build_master_views(df):
+    """Both views of build_master_data from one pass: {False: without positions, True: with}"""
+    rows = _master_rows(df)
+    return {False: _master_view(rows, False), True: _master_view(rows, True)}
+
+def _master_view(rows, positions_mode):
+    if not positions_mode:
+        return {sku: {'name': name, 'client': client, 'positions': []}
+                for sku, name, client in zip(rows['sku'], rows['name'], rows['client'])}
+    
+    first = rows.drop_duplicates('sku')
+    master_data = {sku: {'name': name, 'client': client, 'positions': []}
+                   for sku, name, client in zip(first['sku'], first['name'], first['client'])}
+    
+    placed = rows[rows['position'] != ''].drop_duplicates(['sku', 'position'])
+    # Per-group aggregation is a Python call per SKU; one pass over the deduplicated rows is cheaper
+    for sku, position in zip(placed['sku'].tolist(), placed['position'].tolist()):
+        master_data[sku]['positions'].append(position)
+    return master_data
+
+# Bump when the sidecar layout or the master_data rules change
+MASTER_CACHE_VERSION = 1
+
+def master_cache_path(filepath):
+    """Hidden sidecar next to the master file: .<name>.labelcache"""
+    folder, name = os.path.split(os.path.abspath(filepath))
+    return os.path.join(folder, f".{name}.labelcache")
+
+def master_file_key(filepath):
+    """Path, size and mtime: any change to the master file invalidates its sidecar"""
+    st = os.stat(filepath)
+    return [os.path.abspath(filepath), st.st_size, st.st_mtime_ns]
+
+def _pack_view(master_data):
+    """master_data as parallel sku/name/client/positions lists (smaller and faster to load)"""
+    entries = master_data.values()
+    return [list(master_data), [e['name'] for e in entries], [e['client'] for e in entries],
+            [e['positions'] for e in entries]]
+
+def _unpack_view(columns):
+    skus, names, clients, positions = columns
+    return {sku: {'name': name, 'client': client, 'positions': sku_positions}
+            for sku, name, client, sku_positions in zip(skus, names, clients, positions)}
+
+def load_master_views(filepath):
+    """
+    Both master_data views of a file (see build_master_views), from its sidecar when
+    that still matches the file, else parsed and written to the sidecar.
+    The sidecar is marshal data (plain lists/str only, nothing executed on load);
+    it is tied to the Python version because the marshal format may change between them.
+    Returns (views, from_cache).
+    """
+    key = master_file_key(filepath)
+    cache_path = master_cache_path(filepath)
+    python = list(sys.version_info[:2])
+    # Unpacking allocates a few hundred thousand containers; GC passes over them
+    # would cost more than the unpacking itself
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = marshal.loads(f.read())    # marshal.load(f) reads in tiny pieces
+        if (isinstance(cached, dict) and cached.get('version') == MASTER_CACHE_VERSION
+                and cached.get('python') == python and cached.get('key') == key):
+            without_positions, with_positions = cached['views']
+            return {False: _unpack_view(without_positions), True: _unpack_view(with_positions)}, True
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    finally:
+        if gc_enabled:
+            gc.enable()
+    
+    views = build_master_views(read_master_file(filepath))
+    try:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            marshal.dump({'version': MASTER_CACHE_VERSION, 'python': python, 'key': key,
+                          'views': [_pack_view(views[False]), _pack_view(views[True])]}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # Read-only share etc.: still works, just without the fast path next time
+        print(f"Could not write cache {cache_path}: {e}")
+    return views, False
+
+@functools.lru_cache(maxsize=4096)
+def code128_modules(value):
+    """Code128 symbol width in modules (barWidth=1, no quiet zones); None if it can't be encoded"""
+    try:
+        return code128.Code128(value, barWidth=1, quiet=0).width
+    except Exception:
+        return None
+
+def code128_width(modules, bar_width):
+    """Symbol width in points as Code128 lays it out: bars plus its default quiet zones"""
+    quiet = max(inch * 0.25, bar_width * 10.0)
+    return modules * bar_width + 2 * quiet
+
+@functools.lru_cache(maxsize=4096)
+def fit_code128_barwidth(value, available_width_mm, max_width, min_width):
+    """Widest barWidth in 0.1 steps from max_width down whose symbol fits with 2mm to spare"""
+    modules = code128_modules(value)
+    if modules is not None:
+        limit_mm = available_width_mm - 2
+        for bar_width in [w/10 for w in range(int(max_width*10), int(min_width*10)-1, -1)]:
+            if code128_width(modules, bar_width) / mm <= limit_mm:
+                return bar_width
+    return min_width
+
+SKU_SEARCH_LIMIT = 100       # SKUs shown in the dropdown
+SKU_FILTER_DELAY_MS = 150    # wait for a pause in typing before filtering
+
+class SkuSearchIndex:
+    """
+    Case-insensitive SKU search for the combobox. Hits are ranked exact match,
+    then prefix matches, then other substring matches, each in sorted order.
+    Prefix hits come from a sorted array (bisect). Substring hits are only
+    looked for among the SKUs of the query's rarest character, or among the
+    kept hits of an earlier query it contains, so typing narrows the search
+    instead of rescanning every SKU.
+    """
+    KEEP_QUERIES = 32
+    
+    def __init__(self, skus):
+        self.skus = sorted(skus, key=lambda sku: (sku.lower(), sku))
+        self.lowered = [sku.lower() for sku in self.skus]
+        self.chars = {}     # character -> indexes of the SKUs containing it
+        for i, lowered in enumerate(self.lowered):
+            for char in set(lowered):
+                postings = self.chars.get(char)
+                if postings is None:
+                    self.chars[char] = [i]
+                else:
+                    postings.append(i)
+        self._hits = {}     # query -> indexes of every SKU containing it, oldest first
+    
+    def __len__(self):
+        return len(self.skus)
+    
+    def _substring_hits(self, query):
+        if len(query) == 1:
+            return self.chars.get(query, ())
+        hits = self._hits.get(query)
+        if hits is None:
+            candidates = min([self.chars.get(char, ()) for char in set(query)]
+                             + [kept_hits for kept, kept_hits in self._hits.items() if kept in query], key=len)
+            lowered = self.lowered
+            hits = [i for i in candidates if query in lowered[i]]
+            if len(self._hits) >= self.KEEP_QUERIES:
+                del self._hits[next(iter(self._hits))]
+            self._hits[query] = hits
+        return hits
+    
+    def search(self, query, limit=SKU_SEARCH_LIMIT):
+        """Up to limit SKUs containing query (any case), best matches first"""
+        query = query.lower()
+        if not query:
+            return self.skus[:limit]
+        
+        # Exact matches sort first within the prefix range
+        hits = []
+        i = bisect.bisect_left(self.lowered, query)
+        while i < len(self.lowered) and len(hits) < limit and self.lowered[i].startswith(query):
+            hits.append(self.skus[i])
+            i += 1
+        if len(hits) == limit:
+            return hits
+        
+        for i in self._substring_hits(query):
+            if not self.lowered[i].startswith(query):
+                hits.append(self.skus[i])
+                if len(hits) == limit:
+                    break
+        return hits
+
+def import_tkinter():
+    """Bind the tkinter modules the GUI uses (not imported at module level: batch mode runs headless)"""
+    global tk, ttk, messagebox, filedialog
+    import tkinter as tk
+    from tkinter import ttk, messagebox, filedialog
+
 class LabelGeneratorV3:
     def __init__(self, root):
+        import_tkinter()
         self.root = root
         self.root.title("Warehouse Label Generator v3.9")
         self.root.geometry("600x620")
@@ -68,6 +348,10 @@ class LabelGeneratorV3:
         self.cyrillic_support = setup_fonts()
         
         self.master_data = {}
+        self.master_views = None        # {positions mode: master_data} of the loaded file
+        self.master_views_key = None    # master_file_key() the views were built from
+        self.sku_index = None           # SkuSearchIndex over the loaded SKUs
+        self._filter_job = None         # pending debounced filter_sku update
         self.current_file = None
         
         script_dir = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
@@ -230,84 +514,24 @@ class LabelGeneratorV3:
     def _load_file_internal(self, filepath):
         """Internal method to load file with current settings"""
         try:
-            if filepath.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding='utf-8-sig')
-            else:
-                df = pd.read_excel(filepath)
-            
             print(f"\n=== Loading {os.path.basename(filepath)} ===")
             print(f"Positions mode: {self.positions_mode.get()}")
             
-            column_mapping = {
-                'Фирма': 'client',
-                'Артикул': 'sku',
-                'Име': 'name',
-                'Поз.': 'position',
-                'Поз': 'position',
-                'Client': 'client',
-                'SKU': 'sku',
-                'Name': 'name',
-                'Product': 'name',
-                'Company': 'client',
-                'Position': 'position'
-            }
-            
-            df_renamed = df.rename(columns=column_mapping)
-            
-            if not all(col in df_renamed.columns for col in ['sku', 'name', 'client']):
-                if len(df.columns) >= 3:
-                    df_renamed = df.iloc[:, :3].copy()
-                    df_renamed.columns = ['client', 'sku', 'name']
-                else:
-                    raise ValueError("Could not find required columns")
-            
-            df_clean = df_renamed.dropna(subset=['sku'])
-            df_clean = df_clean[df_clean['sku'].astype(str).str.strip() != '']
-            df_clean = df_clean[~df_clean['sku'].astype(str).str.lower().str.contains('общо|total|sum', na=False)]
+            # Both views stay in memory, so a checkbox toggle doesn't touch the disk
+            key = master_file_key(filepath)
+            if self.master_views is None or self.master_views_key != key:
+                self.master_views, from_cache = load_master_views(filepath)
+                self.master_views_key = key
+                # Both views hold the same SKUs
+                self.sku_index = SkuSearchIndex(self.master_views[False])
+                print("Read from cache" if from_cache else "Parsed file, cache updated")
             
-            self.master_data = {}
             positions_mode = self.positions_mode.get()
-            
-            for _, row in df_clean.iterrows():
-                sku_raw = row['sku']
-                if pd.notna(sku_raw):
-                    try:
-                        sku_float = float(sku_raw)
-                        if sku_float == int(sku_float):
-                            sku = str(int(sku_float)).strip()
-                        else:
-                            sku = str(sku_float).strip()
-                    except (ValueError, TypeError):
-                        sku = str(sku_raw).strip()
-                else:
-                    sku = ''
-                
-                name = str(row['name']).strip()
-                client = str(row['client']).strip()
-                
-                position = ''
-                if positions_mode and 'position' in df_renamed.columns:
-                    pos_raw = row.get('position', '')
-                    if pd.notna(pos_raw):
-                        position = str(pos_raw).strip()
-                
-                if sku and name and client:
-                    if positions_mode:
-                        if sku not in self.master_data:
-                            self.master_data[sku] = {
-                                'name': name,
-                                'client': client,
-                                'positions': []
-                            }
-                        if position and position not in self.master_data[sku]['positions']:
-                            self.master_data[sku]['positions'].append(position)
-                            print(f"  SKU {sku}: position {position}")
-                    else:
-                        self.master_data[sku] = {
-                            'name': name,
-                            'client': client,
-                            'positions': []
-                        }
+            self.master_data = self.master_views[positions_mode]
+            if positions_mode:
+                placed = sum(1 for entry in self.master_data.values() if entry['positions'])
+                print(f"  {sum(len(entry['positions']) for entry in self.master_data.values())} positions "
+                      f"for {placed} SKUs")
             
             if not self.master_data:
                 raise ValueError("No valid data found in file")
@@ -320,7 +544,7 @@ class LabelGeneratorV3:
             )
             
             self.sku_combo['state'] = 'normal'
-            self.sku_combo['values'] = sorted(self.master_data.keys())
+            self.sku_combo['values'] = self.sku_index.search('')
             self.sku_combo.focus()
             
             messagebox.showinfo("Success", f"Loaded {len(self.master_data)} products {mode_text}!")
@@ -330,16 +554,19 @@ class LabelGeneratorV3:
             self.db_status.config(text="✗ Failed to load database", foreground="red")
     
     def filter_sku(self, event=None):
-        """Filter SKU list as user types"""
+        """Filter SKU list as user types (once typing pauses for SKU_FILTER_DELAY_MS)"""
         if not self.master_data:
             return
         
-        typed = self.sku_var.get().lower()
-        if typed == '':
-            self.sku_combo['values'] = sorted(self.master_data.keys())
-        else:
-            filtered = [sku for sku in self.master_data.keys() if typed in sku.lower()]
-            self.sku_combo['values'] = sorted(filtered)
+        if self._filter_job is not None:
+            self.root.after_cancel(self._filter_job)
+        self._filter_job = self.root.after(SKU_FILTER_DELAY_MS, self._apply_sku_filter)
+    
+    def _apply_sku_filter(self):
+        """Show the top SKU_SEARCH_LIMIT matches for the typed text"""
+        self._filter_job = None
+        if self.sku_index is not None:
+            self.sku_combo['values'] = self.sku_index.search(self.sku_var.get())
     
     def on_sku_select(self, event=None):
         """Auto-fill when SKU is selected"""
@@ -371,7 +598,7 @@ class LabelGeneratorV3:
         self.qty_entry.delete(0, tk.END)
         self.sku_combo.focus()
         if self.master_data:
-            self.sku_combo['values'] = sorted(self.master_data.keys())
+            self.sku_combo['values'] = self.sku_index.search('')
     
     def generate_label(self):
         """Generate PDF with selected mode"""
@@ -399,9 +626,7 @@ class LabelGeneratorV3:
             'positions': self.master_data[sku].get('positions', [])
         }
         
-        client_name = data['client']
-        safe_client_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).strip()
-        client_folder = os.path.join(self.save_folder, safe_client_name)
+        client_folder = os.path.join(self.save_folder, safe_folder_name(data['client']))
         
         try:
             os.makedirs(client_folder, exist_ok=True)
@@ -447,22 +672,10 @@ class LabelGeneratorV3:
         - min_width=0.75 (~0.264mm X-dimension) - мінімум для надійного сканування
         - max_width=1.2 (~0.42mm X-dimension) - оптимум для коротких кодів
         """
-        # Тестуємо різні barWidth від максимального до мінімального
-        for bar_width in [w/10 for w in range(int(max_width*10), int(min_width*10)-1, -1)]:
-            try:
-                test_barcode = code128.Code128(str(sku_value), 
-                                               barHeight=target_height_mm*mm, 
-                                               barWidth=bar_width)
-                barcode_width_mm = test_barcode.width / mm
-                
-                # Якщо баркод вміщується з запасом 2mm
-                if barcode_width_mm <= (available_width_mm - 2):
-                    return bar_width
-            except:
-                continue
-        
+        # Ширина баркоду лінійна відносно barWidth (висота на неї не впливає),
+        # тому кодуємо значення один раз і рахуємо ширину для кожного кроку арифметично.
         # Якщо не вміщається навіть з мінімальним - повертаємо мінімум (краще читабельність)
-        return min_width
+        return fit_code128_barwidth(str(sku_value), available_width_mm, max_width, min_width)
     
     def create_main_label(self, filepath, data):
         """Create main label page (100x150mm)"""
@@ -1091,6 +1304,22 @@ class LabelGeneratorV3:
         c.drawString(left_margin, timestamp_y, 
                     f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
     
+    def draw_label_pages(self, c, data, mode):
+        """Draw all pages of one label in a generation mode onto an open canvas (no save)"""
+        if mode != "attachment_only":
+            self.create_main_label_on_canvas(c, data)
+            if mode == "label_only":
+                return
+            c.showPage()
+        
+        self.create_attachment_page(c, data)
+        positions = data.get('positions', [])
+        start_idx = 2
+        while start_idx < len(positions):
+            c.showPage()
+            self.create_continuation_page(c, data, start_idx)
+            start_idx += 3
+    
     def create_attachment_only(self, filepath, data):
         """Create attachment with pagination"""
         width = 100 * mm
@@ -1112,7 +1341,197 @@ class LabelGeneratorV3:
         
         c.save()
 
+def safe_folder_name(client_name):
+    """Client name reduced to characters that are safe in a folder name"""
+    return "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).strip()
+
+# --- Headless batch generation ---
+
+GENERATION_MODES = ("label_only", "both", "attachment_only")
+LABELS_PER_TASK = 25    # labels rendered into one PDF piece by a pool worker
+
+PICK_LIST_COLUMNS = {
+    'Артикул': 'sku',
+    'SKU': 'sku',
+    'Количество': 'quantity',
+    'Кол.': 'quantity',
+    'Кол': 'quantity',
+    'Qty': 'quantity',
+    'Quantity': 'quantity'
+}
+
+class HeadlessLabelGenerator(LabelGeneratorV3):
+    """The drawing methods of LabelGeneratorV3 without a Tk window (batch workers)"""
+    
+    def __init__(self):
+        self.cyrillic_support = setup_fonts()
+
+def read_pick_list(filepath):
+    """
+    [(sku, quantity or None)] in file order from a CSV/Excel pick list with
+    SKU and (optional) quantity columns; without known headers the first two
+    columns are used. Raises ValueError when several headers name the same
+    column (e.g. both 'Артикул' and 'SKU').
+    """
+    if filepath.endswith('.csv'):
+        df = pd.read_csv(filepath, encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(filepath)
+    
+    found = {}
+    for header in df.columns:
+        target = PICK_LIST_COLUMNS.get(header, header if header in ('sku', 'quantity') else None)
+        if target:
+            found.setdefault(target, []).append(str(header))
+    for target, headers in found.items():
+        if len(headers) > 1:
+            raise ValueError(f"Pick list has several {target} columns ({', '.join(headers)}); keep only one")
+    df = df.rename(columns={headers[0]: target for target, headers in found.items()})
+    if 'sku' not in df.columns:
+        df = df.iloc[:, :2].copy()
+        df.columns = ['sku', 'quantity'][:len(df.columns)]
+    df = df.dropna(subset=['sku'])
+    
+    skus = normalize_sku_column(df['sku'])
+    if 'quantity' not in df.columns:
+        return [(sku, None) for sku in skus if sku]
+    
+    picks = []
+    for sku, qty_raw in zip(skus, df['quantity'].tolist()):
+        qty = normalize_sku(qty_raw) if pd.notna(qty_raw) else ''
+        if qty and not qty.isdigit():
+            raise ValueError(f"Quantity for SKU {sku} must be a number or empty, got {qty_raw!r}")
+        if sku:
+            picks.append((sku, qty or None))
+    return picks
+
+_batch_generator = None
+
+def _init_batch_worker():
+    """Register the fonts once per pool process"""
+    global _batch_generator
+    _batch_generator = HeadlessLabelGenerator()
+
+def _render_labels(labels, mode):
+    """Render labels (data dicts as built by generate_label) into one PDF; returns its bytes"""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(100 * mm, 150 * mm))
+    # The drawing methods report every barcode on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        for n, data in enumerate(labels):
+            if n:
+                c.showPage()
+            _batch_generator.draw_label_pages(c, data, mode)
+    c.save()
+    return buffer.getvalue()
+
+def _write_merged_pdf(pieces, filepath):
+    """Concatenate rendered PDF pieces into one file"""
+    if len(pieces) == 1:
+        with open(filepath, 'wb') as f:
+            f.write(pieces[0])
+        return
+    
+    from pypdf import PdfWriter   # only multi-piece batch output needs it
+    writer = PdfWriter()
+    for piece in pieces:
+        writer.append(io.BytesIO(piece))
+    with open(filepath, 'wb') as f:
+        writer.write(f)
+
+def generate_batch(master_file, pick_list=None, mode="label_only", out_dir=None, per_client=False,
+                   header="WAREHOUSE STORAGE", client=None, jobs=None):
+    """
+    Render labels for a whole pick list (or every SKU of the master file) without the GUI.
+    pick_list: CSV/Excel path, see read_pick_list(); None = every SKU once, without quantity.
+    mode: one of GENERATION_MODES; attachment pages use the positions view of the master file.
+    per_client: one PDF per client in <out_dir>/<client>/, else one combined PDF in out_dir.
+    client: only labels for this client.
+    jobs: rendering processes (default: CPU cores).
+    Returns (written PDF paths, SKUs of the pick list missing from the master file).
+    """
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"Unknown mode {mode!r}, choose from {', '.join(GENERATION_MODES)}")
+    
+    views, _ = load_master_views(master_file)
+    master_data = views[mode != "label_only"]
+    picks = read_pick_list(pick_list) if pick_list else [(sku, None) for sku in master_data]
+    
+    labels = []
+    missing = []
+    for sku, qty in picks:
+        entry = master_data.get(sku)
+        if entry is None:
+            missing.append(sku)
+        elif client is None or entry['client'] == client:
+            labels.append({
+                'sku': sku,
+                'name': entry['name'],
+                'client': entry['client'],
+                'quantity': qty,
+                'header': header,
+                'positions': entry.get('positions', [])
+            })
+    
+    out_dir = out_dir or os.path.dirname(os.path.abspath(master_file))
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if per_client:
+        groups = {}
+        for data in labels:
+            folder = safe_folder_name(data['client'])
+            groups.setdefault(os.path.join(out_dir, folder, f"{folder}_{mode}_{timestamp}.pdf"), []).append(data)
+    else:
+        groups = {os.path.join(out_dir, f"labels_{mode}_{timestamp}.pdf"): labels} if labels else {}
+    
+    # Pieces never span two output files, so every file is a plain concatenation
+    tasks = [(filepath, group[start:start + LABELS_PER_TASK])
+             for filepath, group in groups.items()
+             for start in range(0, len(group), LABELS_PER_TASK)]
+    pieces = {filepath: [] for filepath in groups}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker) as pool:
+        rendered = pool.map(_render_labels, [chunk for _, chunk in tasks], [mode] * len(tasks))
+        for (filepath, _), piece in zip(tasks, rendered):
+            pieces[filepath].append(piece)
+    
+    for filepath, file_pieces in pieces.items():
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        _write_merged_pdf(file_pieces, filepath)
+    return list(pieces), missing
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate warehouse labels for a whole pick list")
+    parser.add_argument('--batch', metavar='MASTER', required=True, help="Master database (Excel/CSV)")
+    parser.add_argument('--pick-list', metavar='FILE',
+                        help="CSV/Excel with SKU and quantity columns (default: every SKU, no quantity)")
+    parser.add_argument('--mode', choices=GENERATION_MODES, default="label_only")
+    parser.add_argument('--per-client', action='store_true',
+                        help="One PDF per client instead of one combined PDF")
+    parser.add_argument('--out-dir', help="Output folder (default: next to the master file)")
+    parser.add_argument('--header', default="WAREHOUSE STORAGE", help="Label header text")
+    parser.add_argument('--client', help="Only labels for this client")
+    parser.add_argument('--jobs', type=int, default=None, help="Rendering processes (default: CPU cores)")
+    args = parser.parse_args(argv)
+    
+    started = datetime.now()
+    try:
+        paths, missing = generate_batch(args.batch, args.pick_list, args.mode, args.out_dir, args.per_client,
+                                        args.header, args.client, args.jobs)
+    except Exception as e:
+        print(f"✗ Batch failed: {e}")
+        return 1
+    
+    for sku in missing:
+        print(f"⚠️ SKU not in master file: {sku}")
+    for path in paths:
+        print(f"✓ {path}")
+    print(f"Generated {len(paths)} PDFs in {(datetime.now() - started).total_seconds():.1f}s")
+    return 0
+
 def main():
+    if '--batch' in sys.argv[1:]:
+        sys.exit(batch_main())
+    
+    import_tkinter()
     root = tk.Tk()
     app = LabelGeneratorV3(root)
     root.mainloop()